@@ -0,0 +1 @@
+# Этот файл нужен для обозначения директории как Python-пакета 
\ No newline at end of file
@@ -0,0 +1,63 @@
+"""
+Сравнение результатов бенчмарка с сохраненной базой.
+
+Пример:
+    python -m benchmarks.compare benchmarks/baseline.json bench_results.json --threshold 0.2
+"""
+import argparse
+import json
+
+METRIC = "p50_ms"
+
+
+def compare(baseline, current, threshold=0.2):
+    """
+    Сравнивает медианное время этапов, присутствующих в обоих наборах.
+    Этап считается регрессией, если замедлился больше чем на threshold.
+    """
+    rows = []
+    for name in sorted(set(baseline) & set(current)):
+        base = baseline[name][METRIC]
+        value = current[name][METRIC]
+        ratio = value / base if base else float("inf")
+        rows.append({
+            "stage": name,
+            "baseline_ms": base,
+            "current_ms": value,
+            "ratio": ratio,
+            "regression": ratio > 1 + threshold,
+        })
+    return rows
+
+
+def print_comparison(rows):
+    width = max((len(row["stage"]) for row in rows), default=10)
+    print(f"{'этап':<{width}}  {'база, мс':>10}  {'сейчас, мс':>10}  {'изменение':>9}")
+    for row in rows:
+        mark = "  РЕГРЕССИЯ" if row["regression"] else ""
+        print(
+            f"{row['stage']:<{width}}  {row['baseline_ms']:>10.2f}  {row['current_ms']:>10.2f}"
+            f"  {(row['ratio'] - 1) * 100:>+8.1f}%{mark}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение результатов бенчмарка с базой")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    with open(args.current, "r", encoding="utf-8") as f:
+        current = json.load(f)["results"]
+
+    rows = compare(baseline, current, args.threshold)
+    print_comparison(rows)
+    if any(row["regression"] for row in rows):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
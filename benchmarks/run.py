@@ -0,0 +1,280 @@
+"""
+Воспроизводимый бенчмарк конвейера инференса и отчетов.
+
+Пример:
+    python -m benchmarks.run --output bench_results.json --baseline benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import (
+    DEFAULT_SIZES, StubPredictor, generate_images, parse_sizes, synthetic_rects,
+)
+from benchmarks.compare import compare, print_comparison
+
+STAGES = ("decode", "process", "json", "pdf", "http")
+
+
+def summarize(times):
+    """
+    Статистика по списку длительностей в секундах (в миллисекундах)
+    """
+    ms = sorted(t * 1000 for t in times)
+    return {
+        "runs": len(ms),
+        "mean_ms": sum(ms) / len(ms),
+        "p50_ms": ms[len(ms) // 2],
+        "p95_ms": ms[min(int(len(ms) * 0.95), len(ms) - 1)],
+        "min_ms": ms[0],
+        "max_ms": ms[-1],
+    }
+
+
+def measure(fn, repeat=5, warmup=1):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+def bench_decode(images, repeat):
+    results = {}
+    for size, path in images.items():
+        with open(path, "rb") as f:
+            data = f.read()
+        results[f"decode/{size}"] = measure(
+            lambda: cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR), repeat
+        )
+    return results
+
+
+def bench_process(images, repeat, model_path=None, tile_size=0):
+    from model.process_image import process_image
+
+    predictors = {"stub": StubPredictor()}
+    if model_path:
+        from model.process_image import setup_model
+        predictors["real"] = setup_model(model_path)
+
+    results = {}
+    for name, predictor in predictors.items():
+        runs = repeat if name == "stub" else max(repeat // 2, 1)
+        for size, path in images.items():
+            img = cv2.imread(path)
+            results[f"process/{name}/{size}"] = measure(
+                lambda: process_image(predictor, img, None, tile_size=tile_size or None), runs
+            )
+    return results
+
+
+def bench_json(repeat):
+    results = {}
+    for count in (100, 1000, 10000):
+        rects = synthetic_rects(count)
+        outputs_dict = {
+            "instances": {
+                "num_instances": count,
+                "image_height": 1500,
+                "image_width": 30300,
+                "pred_boxes": [[r["x1"], r["y1"], r["x2"], r["y2"]] for r in rects],
+                "scores": [0.5] * count,
+                "pred_classes": [int(r["className"]) for r in rects],
+            }
+        }
+        results[f"json/indent/{count}"] = measure(lambda: json.dumps(outputs_dict, indent=2), repeat)
+        results[f"json/compact/{count}"] = measure(lambda: json.dumps(outputs_dict), repeat)
+
+        # Столбцовый msgpack-ответ из numpy-массивов (Accept: application/msgpack)
+        from server.result_format import msgpack, pack_instances
+        if msgpack is not None:
+            arrays = {
+                "instances": {
+                    **outputs_dict["instances"],
+                    "pred_boxes": np.asarray(outputs_dict["instances"]["pred_boxes"], dtype=np.float32),
+                    "scores": np.asarray(outputs_dict["instances"]["scores"], dtype=np.float32),
+                    "pred_classes": np.asarray(outputs_dict["instances"]["pred_classes"]),
+                }
+            }
+            results[f"json/msgpack/{count}"] = measure(
+                lambda: msgpack.packb({"instances": pack_instances(arrays["instances"])}, use_bin_type=True), repeat
+            )
+    return results
+
+
+def bench_pdf(repeat, output_dir):
+    from server.pdf_generator import create_pdf
+
+    results = {}
+    for count in (0, 100, 1000, 5000):
+        rects = synthetic_rects(count)
+        results[f"pdf/{count}"] = measure(lambda: create_pdf(f"bench_{count}", output_dir, rects), repeat)
+    return results
+
+
+async def _bench_http(app, images, requests, concurrency):
+    import httpx
+
+    await app.router.startup()
+    transport = httpx.ASGITransport(app=app)
+    results = {}
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            # Модель загружается в фоне после старта
+            while (ready := await client.get("/ready")).status_code != 200:
+                if ready.json()["status"] == "failed":
+                    raise RuntimeError(f"Модель не загружена: {ready.json()['error']}")
+                await asyncio.sleep(0.1)
+
+            user = (await client.post("/users/", json={
+                "fullName": "bench", "status": "bench", "email": "bench@example.com", "password": "bench",
+            })).json()
+
+            for size, path in images.items():
+                with open(path, "rb") as f:
+                    data = f.read()
+
+                latencies = []
+                semaphore = asyncio.Semaphore(concurrency)
+                uploaded = []
+
+                async def upload():
+                    async with semaphore:
+                        start = time.perf_counter()
+                        response = await client.post(
+                            "/upload",
+                            files={"file": ("bench.png", data, "image/png")},
+                            data={"userId": str(user["id"])},
+                        )
+                        latencies.append(time.perf_counter() - start)
+                        response.raise_for_status()
+                        uploaded.append(response.json()["filename"])
+
+                start = time.perf_counter()
+                await asyncio.gather(*(upload() for _ in range(requests)))
+                elapsed = time.perf_counter() - start
+
+                stats = summarize(latencies)
+                stats["throughput_rps"] = requests / elapsed
+                stats["concurrency"] = concurrency
+                results[f"http/upload/{size}"] = stats
+
+                rects = json.dumps(synthetic_rects(100))
+                replace_latencies = []
+                for filename in uploaded[:3]:
+                    start = time.perf_counter()
+                    response = await client.post(
+                        "/replace-image",
+                        files={"file": ("bench.png", data, "image/png")},
+                        data={"userId": str(user["id"]), "filename": filename, "rects": rects},
+                    )
+                    replace_latencies.append(time.perf_counter() - start)
+                    response.raise_for_status()
+                results[f"http/replace-image/{size}"] = summarize(replace_latencies)
+
+            await client.delete(f"/users/{user['id']}")
+    finally:
+        await app.router.shutdown()
+    return results
+
+
+def bench_http(images, requests, concurrency, work_dir, stub_model=True):
+    """
+    Сквозные измерения через ASGI-приложение с SQLite вместо PostgreSQL
+    """
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}?check_same_thread=false"
+    # Кэш предсказаний исказил бы время повторных загрузок одного и того же снимка
+    os.environ["PREDICTION_CACHE_SIZE"] = "0"
+
+    if stub_model:
+        import server.inference_pool as inference_pool
+        inference_pool.create_backend = lambda name, model_path, export_dir: StubPredictor()
+
+    from server.main import app
+    return asyncio.run(_bench_http(app, images, requests, concurrency))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера инференса и отчетов")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Этапы через запятую: {', '.join(STAGES)}")
+    parser.add_argument("--sizes", default=",".join(f"{w}x{h}" for w, h in DEFAULT_SIZES),
+                        help="Размеры синтетических снимков, например 3000x1000,30300x1500")
+    parser.add_argument("--images-dir", default=os.path.join(tempfile.gettempdir(), "radex-bench"))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--model", default=None, help="Путь к весам для измерения реальной модели")
+    parser.add_argument("--tile-size", type=int, default=0)
+    parser.add_argument("--http-requests", type=int, default=8)
+    parser.add_argument("--http-concurrency", type=int, default=4)
+    parser.add_argument("--http-real-model", action="store_true", help="Сквозной тест с реальной моделью")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", default=None, help="JSON с базовыми результатами для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Допустимое замедление (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Неизвестные этапы: {', '.join(sorted(unknown))}")
+
+    images = generate_images(args.images_dir, parse_sizes(args.sizes))
+    work_dir = tempfile.mkdtemp(prefix="radex-bench-")
+
+    results = {}
+    if "decode" in stages:
+        results.update(bench_decode(images, args.repeat))
+    if "process" in stages:
+        results.update(bench_process(images, args.repeat, args.model, args.tile_size))
+    if "json" in stages:
+        results.update(bench_json(args.repeat))
+    if "pdf" in stages:
+        results.update(bench_pdf(args.repeat, work_dir))
+    if "http" in stages:
+        results.update(bench_http(
+            images, args.http_requests, args.http_concurrency, work_dir, stub_model=not args.http_real_model
+        ))
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "sizes": list(images),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Результаты сохранены: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(baseline["results"], results, args.threshold)
+        print_comparison(rows)
+        if any(row["regression"] for row in rows):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
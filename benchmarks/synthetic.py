@@ -0,0 +1,112 @@
+import os
+
+import cv2
+import numpy as np
+
+# Размеры синтетических снимков (ширина x высота), до ~30000 px по ширине, как реальные пленки
+DEFAULT_SIZES = [(3000, 1000), (10000, 1200), (30300, 1500)]
+
+
+def parse_sizes(value):
+    """
+    Разбор строки вида "3000x1000,30300x1500"
+    """
+    sizes = []
+    for item in value.split(","):
+        width, height = item.lower().split("x")
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def synthetic_radiograph(width, height, num_pores=200, seed=0):
+    """
+    Синтетическая рентгенограмма: неравномерный фон, горизонтальный шов,
+    шум и мелкие темные поры. Одноканальное uint8-изображение.
+    """
+    rng = np.random.default_rng(seed)
+
+    rows = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    cols = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    img = 90 + 40 * cols + 10 * np.sin(rows * np.pi)
+
+    # Шов - более светлая горизонтальная полоса по центру снимка
+    seam_top, seam_bottom = int(height * 0.4), int(height * 0.6)
+    img[seam_top:seam_bottom] += 60
+
+    img += rng.normal(0, 6, size=(height, width)).astype(np.float32)
+    img = np.clip(img, 0, 255).astype(np.uint8)
+
+    for _ in range(num_pores):
+        x = int(rng.integers(0, width))
+        y = int(rng.integers(seam_top, seam_bottom))
+        cv2.circle(img, (x, y), int(rng.integers(2, 8)), 40, -1)
+
+    return img
+
+
+def generate_images(output_dir, sizes=None):
+    """
+    Создает (или переиспользует) PNG-снимки заданных размеров, возвращает {размер: путь}
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {}
+    for width, height in sizes or DEFAULT_SIZES:
+        path = os.path.join(output_dir, f"radiograph_{width}x{height}.png")
+        if not os.path.exists(path):
+            cv2.imwrite(path, synthetic_radiograph(width, height))
+        paths[f"{width}x{height}"] = path
+    return paths
+
+
+# Типичные для пленок классы: пора, включение, подрез, скрытая пора
+RECT_CLASSES = [0, 1, 2, 9]
+RECT_CLASS_WEIGHTS = [0.6, 0.2, 0.1, 0.1]
+
+
+def synthetic_rects(count, max_x=30300, seed=0):
+    """
+    Прямоугольники дефектов в формате, который фронтенд отправляет в /replace-image
+    """
+    rng = np.random.default_rng(seed)
+    rects = []
+    for _ in range(count):
+        x1 = float(rng.uniform(0, max_x))
+        y1 = float(rng.uniform(0, 1500))
+        rects.append({
+            "x1": x1,
+            "y1": y1,
+            "x2": x1 + float(rng.uniform(5, 60)),
+            "y2": y1 + float(rng.uniform(5, 60)),
+            "className": str(int(rng.choice(RECT_CLASSES, p=RECT_CLASS_WEIGHTS))),
+        })
+    return rects
+
+
+class StubPredictor:
+    """
+    Заглушка предиктора с фиксированным числом рамок.
+    Позволяет измерить накладные расходы конвейера без стоимости самой модели.
+    """
+
+    def __init__(self, num_boxes=20):
+        self.num_boxes = num_boxes
+
+    def __call__(self, img):
+        # Импорт здесь, чтобы этапы без модели (json, pdf) не требовали torch и detectron2
+        import torch
+        from detectron2.structures import Boxes, Instances
+
+        height, width = img.shape[:2]
+        generator = torch.Generator().manual_seed(0)
+        x1 = torch.rand(self.num_boxes, generator=generator) * max(width - 50, 1)
+        y1 = torch.rand(self.num_boxes, generator=generator) * max(height - 50, 1)
+        boxes = torch.stack([x1, y1, x1 + 40, y1 + 40], dim=1)
+
+        instances = Instances((height, width))
+        instances.pred_boxes = Boxes(boxes)
+        instances.scores = torch.rand(self.num_boxes, generator=generator)
+        instances.pred_classes = torch.randint(0, 13, (self.num_boxes,), generator=generator)
+        return {"instances": instances}
+
+    def predict_batch(self, images):
+        return [self(img) for img in images]
@@ -0,0 +1,22 @@
+"""
+Запуск нескольких воркеров с общей копией весов модели (preload-then-fork):
+    MODEL_PRELOAD=1 gunicorn server.main:app -c gunicorn.conf.py
+Только для инференса на CPU: CUDA-контекст не переживает fork, поэтому с доступным GPU
+и бэкендом eager сервер с MODEL_PRELOAD не запускается.
+"""
+import gc
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Приложение (и веса модели) импортируется один раз в мастер-процессе до fork
+preload_app = os.getenv("MODEL_PRELOAD", "0").lower() in ("1", "true", "yes")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+forwarded_allow_ips = "*"
+
+
+def pre_fork(server, worker):
+    # Объекты мастер-процесса исключаются из сборки мусора: иначе обход GC в воркерах
+    # записывает в их заголовки и копирует страницы памяти, общие после fork
+    gc.freeze()
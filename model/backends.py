@@ -0,0 +1,247 @@
+import argparse
+import glob
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+import detectron2.data.transforms as T
+from detectron2.export import TracingAdapter
+from detectron2.modeling.postprocessing import detector_postprocess
+from detectron2.structures import Boxes, Instances
+
+from model.process_image import setup_cfg, setup_model
+from model.inference import predict_batch, instances_to_arrays
+from model.tiling import match_boxes
+
+BACKENDS = ("eager", "quantized", "torchscript", "onnx")
+
+# Порядок выходов экспортированной модели совпадает с порядком полей
+# в схеме TracingAdapter (поля Instances отсортированы по имени, затем размер изображения)
+OUTPUT_NAMES = ["pred_boxes", "pred_classes", "scores", "image_size"]
+
+EXPORT_FILES = {
+    "torchscript": "model.ts",
+    "onnx": "model.onnx",
+}
+
+
+def _inference_without_postprocess(model, inputs):
+    # Постобработка (масштабирование рамок) выполняется вне экспортированной модели
+    instances = model.inference(inputs, do_postprocess=False)[0]
+    return [{"instances": instances}]
+
+
+def _sample_image(height=800, width=1333):
+    """
+    Синтетический снимок для трассировки модели
+    """
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+
+
+def _preprocess(predictor, img):
+    if predictor.input_format == "RGB":
+        img = img[:, :, ::-1]
+    image = predictor.aug.get_transform(img).apply_image(img)
+    return torch.as_tensor(np.ascontiguousarray(image.astype("float32").transpose(2, 0, 1)))
+
+
+def export_model(model_path, fmt, output_dir, sample_image=None):
+    """
+    Экспорт обученной модели в TorchScript или ONNX через TracingAdapter.
+    Возвращает путь к экспортированному файлу.
+    """
+    if fmt not in EXPORT_FILES:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+
+    predictor = setup_model(model_path, device="cpu")
+    model = predictor.model.eval()
+    image = _preprocess(predictor, sample_image if sample_image is not None else _sample_image())
+
+    adapter = TracingAdapter(model, [{"image": image}], _inference_without_postprocess)
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, EXPORT_FILES[fmt])
+
+    with torch.no_grad():
+        if fmt == "torchscript":
+            traced = torch.jit.trace(adapter, (image,))
+            torch.jit.save(traced, output_path)
+        else:
+            torch.onnx.export(
+                adapter, (image,), output_path,
+                opset_version=16,
+                input_names=["image"],
+                output_names=OUTPUT_NAMES,
+                dynamic_axes={"image": {1: "height", 2: "width"}},
+            )
+
+    print(f"Модель экспортирована: {output_path}")
+    return output_path
+
+
+def quantize_predictor(predictor):
+    """
+    Динамическая int8-квантизация полносвязных слоев модели (только CPU)
+    """
+    predictor.model = torch.ao.quantization.quantize_dynamic(
+        predictor.model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return predictor
+
+
+class ExportedPredictor:
+    """
+    Предиктор поверх экспортированной модели (TorchScript или ONNX Runtime).
+    Повторяет интерфейс DefaultPredictor: вызов с BGR-изображением возвращает {"instances": Instances}.
+    """
+
+    def __init__(self, model_path, fmt, export_dir):
+        if fmt not in EXPORT_FILES:
+            raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+
+        # Конфигурация и предобработка те же, что у DefaultPredictor исходной модели
+        self.cfg = setup_cfg(model_path, device="cpu")
+        self.aug = T.ResizeShortestEdge(
+            [self.cfg.INPUT.MIN_SIZE_TEST, self.cfg.INPUT.MIN_SIZE_TEST], self.cfg.INPUT.MAX_SIZE_TEST
+        )
+        self.input_format = self.cfg.INPUT.FORMAT
+
+        self.fmt = fmt
+        path = os.path.join(export_dir, EXPORT_FILES[fmt])
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Экспортированная модель не найдена: {path}")
+
+        if fmt == "torchscript":
+            self._model = torch.jit.load(path, map_location="cpu").eval()
+        else:
+            try:
+                import onnxruntime
+            except ImportError as e:
+                raise ImportError("Для INFERENCE_BACKEND=onnx требуется пакет onnxruntime") from e
+
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = torch.get_num_threads()
+            self._session = onnxruntime.InferenceSession(
+                path, sess_options=options, providers=["CPUExecutionProvider"]
+            )
+
+    def _run(self, image):
+        if self.fmt == "torchscript":
+            with torch.no_grad():
+                outputs = self._model(image)
+            return dict(zip(OUTPUT_NAMES, outputs))
+
+        outputs = self._session.run(OUTPUT_NAMES, {"image": image.numpy()})
+        return {name: torch.from_numpy(value) for name, value in zip(OUTPUT_NAMES, outputs)}
+
+    def __call__(self, img):
+        height, width = img.shape[:2]
+        image = _preprocess(self, img)
+        outputs = self._run(image)
+
+        instances = Instances(tuple(image.shape[1:]))
+        instances.pred_boxes = Boxes(outputs["pred_boxes"])
+        instances.scores = outputs["scores"]
+        instances.pred_classes = outputs["pred_classes"]
+        return {"instances": detector_postprocess(instances, height, width)}
+
+    def predict_batch(self, images):
+        # Экспортированная модель трассирована на одно изображение
+        return [self(img) for img in images]
+
+
+def create_backend(name, model_path, export_dir):
+    """
+    Создает предиктор для выбранного бэкенда инференса
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд инференса: {name}")
+
+    if name == "eager":
+        return setup_model(model_path)
+    if name == "quantized":
+        return quantize_predictor(setup_model(model_path, device="cpu"))
+    return ExportedPredictor(model_path, name, export_dir)
+
+
+def check_parity(reference, candidate, images, iou_threshold=0.9):
+    """
+    Сравнение рамок, уверенностей и классов кандидата с эталонной (eager) моделью.
+    Кроме точности считает среднее время на изображение для обеих моделей.
+    """
+    ref_total = cand_total = 0
+    matches = []
+    ref_time = cand_time = 0.0
+
+    for img in images:
+        start = time.perf_counter()
+        ref = instances_to_arrays(predict_batch(reference, [img])[0]["instances"])
+        ref_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        cand = instances_to_arrays(predict_batch(candidate, [img])[0]["instances"])
+        cand_time += time.perf_counter() - start
+
+        ref_total += len(ref[0])
+        cand_total += len(cand[0])
+        matches.extend(match_boxes(ref, cand, iou_threshold))
+
+    count = max(len(images), 1)
+    return {
+        "images": len(images),
+        "reference_boxes": ref_total,
+        "candidate_boxes": cand_total,
+        "matched_boxes": len(matches),
+        "recall": len(matches) / ref_total if ref_total else 1.0,
+        "precision": len(matches) / cand_total if cand_total else 1.0,
+        "mean_iou": float(np.mean([m[0] for m in matches])) if matches else None,
+        "max_score_diff": max((m[1] for m in matches), default=0.0),
+        "reference_sec_per_image": ref_time / count,
+        "candidate_sec_per_image": cand_time / count,
+        "speedup": ref_time / cand_time if cand_time else None,
+    }
+
+
+def load_samples(samples_dir, limit=None):
+    paths = sorted(glob.glob(os.path.join(samples_dir, "*.png")))[:limit]
+    images = [cv2.imread(path) for path in paths]
+    return [img for img in images if img is not None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экспорт модели и проверка соответствия бэкендов инференса")
+    parser.add_argument("--model", default="/app/model/utils/model.pth")
+    parser.add_argument("--export-dir", default="/app/model/exported")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Экспорт в TorchScript или ONNX")
+    export_parser.add_argument("--format", choices=sorted(EXPORT_FILES), required=True)
+
+    parity_parser = subparsers.add_parser("parity", help="Сравнение бэкенда с eager-моделью")
+    parity_parser.add_argument("--backend", choices=BACKENDS, required=True)
+    parity_parser.add_argument("--samples", required=True, help="Директория с PNG-снимками")
+    parity_parser.add_argument("--limit", type=int, default=None)
+    parity_parser.add_argument("--iou", type=float, default=0.9)
+    parity_parser.add_argument("--min-recall", type=float, default=0.98)
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_model(args.model, args.format, args.export_dir)
+        return
+
+    images = load_samples(args.samples, args.limit)
+    reference = setup_model(args.model, device="cpu")
+    candidate = create_backend(args.backend, args.model, args.export_dir)
+    report = check_parity(reference, candidate, images, iou_threshold=args.iou)
+    print(json.dumps(report, indent=2))
+
+    if report["recall"] < args.min_recall:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
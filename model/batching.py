@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+from .inference import predict_batch
+
+
+class BatchingPredictor:
+    """
+    Обертка над DefaultPredictor, собирающая одновременные запросы в пакеты.
+    Пакет отправляется в модель, когда набрано max_batch_size изображений
+    или истекло max_wait_ms миллисекунд с момента первого запроса в пакете.
+    """
+
+    def __init__(self, predictor, max_batch_size=8, max_wait_ms=10):
+        self.predictor = predictor
+        self.cfg = predictor.cfg
+        self.max_batch_size = max(int(max_batch_size), 1)
+        self.max_wait_ms = max(float(max_wait_ms), 0.0)
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name="batching-predictor", daemon=True)
+        self._thread.start()
+
+    def __call__(self, img):
+        return self.submit(img).result()
+
+    def submit(self, img):
+        """
+        Ставит изображение в очередь, возвращает Future с результатом модели
+        """
+        if self._closed:
+            raise RuntimeError("BatchingPredictor остановлен")
+        future = Future()
+        self._queue.put((img, future))
+        return future
+
+    def predict_batch(self, images):
+        """
+        Отправляет несколько изображений (например, окна одного снимка)
+        в общую очередь, чтобы они объединялись с запросами других клиентов
+        """
+        futures = [self.submit(img) for img in images]
+        return [future.result() for future in futures]
+
+    def _collect(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            batch = [(img, future) for img, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+
+            try:
+                outputs = predict_batch(self.predictor, [img for img, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+
+    def stats(self):
+        """
+        Статистика заполнения пакетов
+        """
+        with self._lock:
+            sizes = dict(self._batch_sizes)
+
+        batches = sum(sizes.values())
+        requests = sum(size * count for size, count in sizes.items())
+        avg_batch_size = requests / batches if batches else 0.0
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batches": batches,
+            "requests": requests,
+            "avg_batch_size": avg_batch_size,
+            "avg_fill_ratio": avg_batch_size / self.max_batch_size,
+            "batch_size_histogram": {str(size): sizes[size] for size in sorted(sizes)},
+            "queue_depth": self._queue.qsize(),
+        }
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,149 @@
+import io
+import struct
+import tempfile
+
+import cv2
+import numpy as np
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_GRAYSCALE = 0
+# Каналов на пиксель по color_type из IHDR (палитра раскрывается в цвет)
+PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def png_header(data):
+    """
+    Размеры и формат PNG по заголовку IHDR (первые 33 байта файла) без декодирования.
+    Возвращает словарь width, height, bit_depth, color_type, interlace или None, если это не PNG.
+    """
+    head = bytes(data[:33])
+    if len(head) < 33 or head[:8] != PNG_SIGNATURE or head[12:16] != b"IHDR":
+        return None
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", head[16:29])
+    return {
+        "width": width,
+        "height": height,
+        "bit_depth": bit_depth,
+        "color_type": color_type,
+        "interlace": interlace,
+    }
+
+
+def _iter_idat(stream):
+    """
+    Сжатые данные IDAT частями не больше READ_CHUNK_SIZE, без чтения файла целиком
+    """
+    stream.seek(len(PNG_SIGNATURE))
+    while True:
+        head = stream.read(8)
+        if len(head) < 8:
+            return
+        length, chunk_type = struct.unpack(">I4s", head)
+        if chunk_type == b"IEND":
+            return
+        if chunk_type != b"IDAT":
+            stream.seek(length + 4, io.SEEK_CUR)
+            continue
+        remaining = length
+        while remaining > 0:
+            piece = stream.read(min(READ_CHUNK_SIZE, remaining))
+            if not piece:
+                raise ValueError("PNG обрезан")
+            remaining -= len(piece)
+            yield piece
+        stream.seek(4, io.SEEK_CUR)  # CRC
+
+
+def _stream_gray8(stream, out):
+    """
+    Потоковое декодирование 8-битного одноканального PNG построчно прямо в out
+    (numpy-массив или memmap): распакованный снимок не собирается в памяти целиком
+    """
+    height, width = out.shape
+    target = PILImage.frombuffer("L", (width, height), out, "raw", "L", 0, 1)
+    decoder = PILImage._getdecoder("L", "zip", ("L", 0))
+    decoder.setimage(target.im, (0, 0, width, height))
+    try:
+        for piece in _iter_idat(stream):
+            while piece:
+                consumed, error = decoder.decode(piece)
+                if consumed < 0:
+                    if error < 0:
+                        raise ValueError(f"Ошибка декодирования PNG: {error}")
+                    return out
+                piece = piece[consumed:]
+        raise ValueError("PNG обрезан")
+    finally:
+        decoder.cleanup()
+
+
+def _can_stream(header):
+    # _getdecoder - внутренний API Pillow (версия закреплена в requirements.txt);
+    # без него снимки декодируются через OpenCV
+    return (
+        PILImage is not None
+        and hasattr(PILImage, "_getdecoder")
+        and header is not None
+        and header["color_type"] == PNG_GRAYSCALE
+        and header["bit_depth"] == 8
+        and header["interlace"] == 0
+    )
+
+
+def decode_memory(header):
+    """
+    Оценка памяти, которую занимает decode_gray для PNG с заголовком header, в байтах:
+    одноканальный результат плюс, если снимок не декодируется потоково, полный кадр
+    (ширина x высота x каналы x байт на отсчет) при декодировании через OpenCV
+    """
+    pixels = header["width"] * header["height"]
+    if _can_stream(header):
+        return pixels
+    channels = PNG_CHANNELS.get(header["color_type"], 4)
+    return pixels + pixels * channels * (2 if header["bit_depth"] > 8 else 1)
+
+
+def _allocate(height, width, spill_dir):
+    if not spill_dir:
+        return np.empty((height, width), dtype=np.uint8)
+    # Файл удаляется сразу, отображение живет, пока жив массив
+    with tempfile.TemporaryFile(dir=spill_dir) as f:
+        return np.memmap(f, dtype=np.uint8, mode="w+", shape=(height, width))
+
+
+def decode_gray(source, spill_dir=None):
+    """
+    Декодирование снимка в одноканальный uint8-массив (1 байт на пиксель вместо 3 у BGR).
+    source - содержимое файла (bytes/bytearray) или путь к нему.
+    8-битные одноканальные PNG декодируются потоково по строкам; с spill_dir снимок
+    записывается в отображаемый в память временный файл, и его страницы может вытеснить ОС.
+    Остальные форматы, а также PNG, которые не удалось декодировать потоково,
+    декодируются целиком через OpenCV сразу в оттенки серого.
+    """
+    is_path = isinstance(source, str)
+    if is_path:
+        with open(source, "rb") as f:
+            header = png_header(f.read(33))
+    else:
+        header = png_header(source)
+
+    if _can_stream(header):
+        out = _allocate(header["height"], header["width"], spill_dir)
+        try:
+            if is_path:
+                with open(source, "rb") as f:
+                    return _stream_gray8(f, out)
+            return _stream_gray8(io.BytesIO(source), out)
+        except Exception:
+            # Несовместимый декодер Pillow или поврежденный поток: решение за OpenCV
+            del out
+
+    if is_path:
+        return cv2.imread(source, cv2.IMREAD_GRAYSCALE)
+    return cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
@@ -0,0 +1,40 @@
+import numpy as np
+import torch
+
+
+def predict_batch(predictor, images):
+    """
+    Пакетный прогон списка BGR-изображений через модель DefaultPredictor.
+    Повторяет предобработку DefaultPredictor.__call__, но выполняет
+    один forward-проход на весь пакет.
+    Обертки с собственным методом predict_batch (например, BatchingPredictor)
+    обрабатывают пакет сами.
+    """
+    if not images:
+        return []
+
+    if hasattr(predictor, "predict_batch"):
+        return predictor.predict_batch(images)
+
+    with torch.no_grad():
+        inputs = []
+        for img in images:
+            if predictor.input_format == "RGB":
+                img = img[:, :, ::-1]
+            height, width = img.shape[:2]
+            image = predictor.aug.get_transform(img).apply_image(img)
+            image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
+            image = image.to(predictor.cfg.MODEL.DEVICE)
+            inputs.append({"image": image, "height": height, "width": width})
+
+        return predictor.model(inputs)
+
+
+def instances_to_arrays(instances):
+    """
+    Переводит Instances Detectron2 в numpy-массивы (boxes, scores, classes)
+    """
+    boxes = instances.pred_boxes.tensor.cpu().numpy().astype(np.float32)
+    scores = instances.scores.cpu().numpy().astype(np.float32)
+    classes = instances.pred_classes.cpu().numpy().astype(np.int64)
+    return boxes, scores, classes
@@ -0,0 +1,128 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def convert_to_uint8(image):
+    """
+    Приводит изображение к формату uint8.
+    """
+    if image.dtype == np.uint8:
+        return image
+
+    # Ограничиваем диапазон значений [0, 255]
+    image = np.clip(image, 0, 255)
+
+    # Преобразуем к uint8
+    return image.astype(np.uint8)
+
+
+def _histogram(channel):
+    return cv2.calcHist([channel], [0], None, [256], [0, 256]).ravel()
+
+
+class HistogramMatcher:
+    """
+    Приведение гистограммы снимков к гистограмме эталонного изображения.
+    CDF эталона считается один раз; для каждого снимка строится таблица
+    из 256 значений, которая применяется на месте через cv2.LUT.
+    """
+
+    def __init__(self, reference):
+        reference = convert_to_uint8(reference)
+        if reference.ndim == 3:
+            reference = cv2.cvtColor(reference, cv2.COLOR_BGR2GRAY)
+
+        # Интерполяция идет только по присутствующим в эталоне уровням,
+        # чтобы значения CDF строго возрастали (как в skimage match_histograms)
+        hist = _histogram(reference)
+        present = hist > 0
+        cdf = np.cumsum(hist)
+        self.reference_values = np.arange(256, dtype=np.float64)[present]
+        self.reference_quantiles = (cdf / cdf[-1])[present]
+
+    def lut_for(self, image):
+        """
+        Таблица преобразования уровней яркости для снимка
+        """
+        channel = image if image.ndim == 2 else image[:, :, 0]
+        cdf = np.cumsum(_histogram(channel))
+        lut = np.interp(cdf / cdf[-1], self.reference_quantiles, self.reference_values)
+        return np.clip(np.rint(lut), 0, 255).astype(np.uint8)
+
+    def __call__(self, image):
+        """
+        Нормализует uint8-снимок на месте и возвращает его же.
+        Рентгенограммы по сути одноканальные, поэтому таблица строится
+        по первому каналу и применяется ко всем.
+        """
+        lut = self.lut_for(image)
+        cv2.LUT(image, lut, dst=image)
+        return image
+
+
+@lru_cache(maxsize=8)
+def load_matcher(reference_path):
+    """
+    Загружает эталон и кэширует HistogramMatcher для пути
+    """
+    reference_image = cv2.imread(reference_path, cv2.IMREAD_GRAYSCALE)
+    if reference_image is None:
+        raise FileNotFoundError(f"Не удалось загрузить эталонное изображение: {reference_path}")
+    return HistogramMatcher(reference_image)
+
+
+def _match_file(input_path, output_path, reference_path):
+    image = cv2.imread(input_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        print(f"[Ошибка] Не удалось загрузить: {input_path}")
+        return False
+
+    load_matcher(reference_path)(image)
+    return cv2.imwrite(output_path, image)
+
+
+def process_images_histogram_matching(input_dir, output_dir, reference_path, workers=None):
+    """
+    Приводит яркость всех изображений в input_dir к яркости reference_path
+    с использованием гистограмменого выравнивания.
+    Снимки обрабатываются в пуле процессов; эталон загружается один раз на процесс.
+    Возвращает количество обработанных изображений.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Проверяем эталон до запуска пула
+    load_matcher(reference_path)
+    print(f"[INFO] Применение гистограмменого выравнивания к {reference_path}")
+
+    filenames = [name for name in sorted(os.listdir(input_dir)) if name.lower().endswith(IMAGE_EXTENSIONS)]
+    input_paths = [os.path.join(input_dir, name) for name in filenames]
+    output_paths = [os.path.join(output_dir, name) for name in filenames]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            _match_file, input_paths, output_paths, [reference_path] * len(filenames), chunksize=4
+        )
+        return sum(1 for ok in results if ok)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Гистограммное выравнивание директории снимков по эталону")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("reference_path")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    count = process_images_histogram_matching(args.input_dir, args.output_dir, args.reference_path, args.workers)
+    print(f"[INFO] Обработано изображений: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
 import os
-import cv2
 import torch
 import numpy as np
 import json
@@ -7,124 +6,145 @@ from detectron2.config import get_cfg
 from detectron2.engine import DefaultPredictor
 from detectron2.utils.visualizer import Visualizer
 from detectron2.data import MetadataCatalog
-# from skimage.exposure import match_histograms
 import glob
-
-# Глобальная переменная для хранения последних результатов
-last_prediction_results = None
-
-def setup_model(model_path):
+from model.tiling import predict_tiled, to_model_input
+from model.decoding import decode_gray
+from model.inference import instances_to_arrays
+
+CONFIG_PATH = "/app/model/utils/cascade_mask_rcnn_R_50_FPN_3x.yaml"
+SCORE_THRESH_TEST = 0.35
+CLASS_NAMES = [
+    "pora", "vkl", "podrez", "projog", "crack",
+    "napliv", "etalon1", "etalon2", "etalon3",
+    "pora-concealed", "utjazhina", "nesplavlenie", "neprovar-kornja"
+]
+
+def setup_cfg(model_path, device=None):
     """
-    Инициализация модели Detectron2
+    Конфигурация модели Detectron2.
+    device - "cuda" или "cpu"; по умолчанию выбирается автоматически.
     """
     cfg = get_cfg()
-    cfg.merge_from_file("/app/model/utils/cascade_mask_rcnn_R_50_FPN_3x.yaml")
+    cfg.merge_from_file(CONFIG_PATH)
     
     # Настройка модели под ваши классы
     # cfg.MODEL.ROI_HEADS.NUM_CLASSES = 13  # Количество классов в вашей модели
     cfg.MODEL.ROI_HEADS.NAME = "StandardROIHeads"
     cfg.MODEL.MASK_ON = False
-    cfg.MODEL.ROI_HEADS.NUM_CLASSES = 13
-    cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.35
+    cfg.MODEL.ROI_HEADS.NUM_CLASSES = len(CLASS_NAMES)
+    cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = SCORE_THRESH_TEST
     cfg.MODEL.WEIGHTS = model_path
-    cfg.MODEL.DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+    cfg.MODEL.DEVICE = device or ("cuda" if torch.cuda.is_available() else "cpu")
     
     # Создаем метаданные для ваших классов
-    MetadataCatalog.get("custom_dataset").set(thing_classes= [
-                                                                "pora", "vkl", "podrez", "projog", "crack",
-                                                                "napliv", "etalon1", "etalon2", "etalon3",
-                                                                "pora-concealed", "utjazhina", "nesplavlenie", "neprovar-kornja"
-                                                            ])
+    MetadataCatalog.get("custom_dataset").set(thing_classes=CLASS_NAMES)
     
-    return DefaultPredictor(cfg)
-
-def match_histogram(image, reference):
-    """
-    Приводит гистограмму image к гистограмме reference.
-    """
-    # Применим match_histograms для grayscale изображений
-    matched = match_histograms(image, reference, channel_axis=None)
-    return matched
+    return cfg
 
-def convert_to_uint8(image):
+def setup_model(model_path, device=None):
     """
-    Приводит изображение к формату uint8.
+    Инициализация модели Detectron2
     """
-    # Ограничиваем диапазон значений [0, 255]
-    image = np.clip(image, 0, 255)
-
-    # Преобразуем к uint8
-    return image.astype(np.uint8)
+    return DefaultPredictor(setup_cfg(model_path, device))
 
-def process_images_histogram_matching(input_dir, output_dir, reference_path):
+def model_identity(model_path, backend="eager", **extra):
     """
-    Приводит яркость всех изображений в input_dir к яркости reference_path
-    с использованием гистограмменого выравнивания.
+    Параметры, от которых зависят предсказания модели.
+    Используется как часть ключа кэша предсказаний.
+    extra - дополнительные параметры конвейера (например, эталон предобработки).
     """
-    os.makedirs(output_dir, exist_ok=True)
-
-    # Загрузим эталонное изображение
-    reference_image = cv2.imread(reference_path, cv2.IMREAD_GRAYSCALE)
-    if reference_image is None:
-        print(f"[Ошибка] Не удалось загрузить эталонное изображение: {reference_path}")
-        return
-
-    print(f"[INFO] Применение гистограмменого выравнивания к {reference_path}")
-
-    for filename in os.listdir(input_dir):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-            input_path = os.path.join(input_dir, filename)
-            output_path = os.path.join(output_dir, filename)
-
-            # Загрузим изображение
-            image = cv2.imread(input_path, cv2.IMREAD_GRAYSCALE)
-            if image is None:
-                print(f"[Ошибка] Не удалось загрузить: {input_path}")
-                continue
-
-            # Применим гистограмменое выравнивание
-            matched = match_histogram(image, reference_image)
-
-            # Преобразуем к uint8 для сохранения
-            matched_uint8 = convert_to_uint8(matched)
-
-
-    
-    return matched_uint8
-
-
-
-def process_image(predictor, image_path, output_path):
+    identity = {
+        "weights": os.path.abspath(model_path),
+        "backend": backend,
+        "score_thresh_test": SCORE_THRESH_TEST,
+        "classes": CLASS_NAMES,
+        **extra,
+    }
+    # Переобученные веса по тому же пути не должны отдавать старые результаты
+    if os.path.exists(model_path):
+        stat = os.stat(model_path)
+        identity["weights_size"] = stat.st_size
+        identity["weights_mtime"] = int(stat.st_mtime)
+    return identity
+
+def process_image(predictor, image_path, output_path, tile_size=None, tile_overlap=128,
+                  tile_batch_size=4, tile_merge="nms", preprocess=None, as_arrays=False, roi=None,
+                  screen=None):
     """
-    Обработка одного изображения
+    Обработка одного изображения.
+    image_path - путь к файлу или уже декодированное изображение (numpy-массив, BGR или
+    одноканальное). Файл декодируется в одноканальный массив; до 3 каналов снимок
+    расширяется только на входе модели (при инференсе окнами - по одному окну).
+    Если задан tile_size и снимок больше окна, используется инференс скользящим окном.
+    preprocess - преобразование снимка на месте перед моделью (например, HistogramMatcher).
+    as_arrays=True оставляет рамки, уверенности и классы numpy-массивами без перевода в списки.
+    roi - поиск полосы шва (например, SeamDetector): модель получает только полосу,
+    рамки переводятся в координаты всего снимка; без уверенной полосы обрабатывается весь снимок.
+    screen - отсев пустых окон перед моделью (например, TileScreener), только при инференсе окнами.
     """
-    global last_prediction_results
-    img = cv2.imread(image_path)
+    if isinstance(image_path, np.ndarray):
+        img = image_path
+        image_path = "<array>"
+    else:
+        img = decode_gray(image_path)
 
     if img is None:
         print(f"Не удалось загрузить изображение: {image_path}")
         return
     
-    # Получение предсказаний
-    outputs = predictor(img)
-    
     # Получаем размеры изображения
     height, width = img.shape[:2]
+
+    if preprocess is not None:
+        img = preprocess(img)
+
+    # Обрезка до полосы шва (срез строк - без копирования)
+    band = roi(img) if roi is not None else None
+    y_offset = 0
+    if band is not None:
+        y_offset = band["y0"]
+        img = img[band["y0"]:band["y1"]]
+
+    # Получение предсказаний
+    triage = {"tiles": 1, "skipped": 0}
+    if tile_size and max(img.shape[:2]) > tile_size:
+        boxes, scores, classes = predict_tiled(
+            predictor, img,
+            tile_size=tile_size,
+            overlap=tile_overlap,
+            batch_size=tile_batch_size,
+            merge=tile_merge,
+            screen=screen,
+            stats=triage,
+        )
+    else:
+        outputs = predictor(to_model_input(img))
+        boxes, scores, classes = instances_to_arrays(outputs["instances"])
+
+    if y_offset:
+        boxes[:, [1, 3]] += y_offset
     
     # Формируем словарь в нужном формате
     outputs_dict = {
         "instances": {
-            "num_instances": len(outputs["instances"]),
+            "num_instances": len(scores),
             "image_height": height,
             "image_width": width,
-            "pred_boxes": outputs["instances"].pred_boxes.tensor.cpu().numpy().tolist(),
-            "scores": outputs["instances"].scores.cpu().numpy().tolist(),
-            "pred_classes": outputs["instances"].pred_classes.cpu().numpy().tolist()
+            "pred_boxes": boxes if as_arrays else boxes.tolist(),
+            "scores": scores if as_arrays else scores.tolist(),
+            "pred_classes": classes if as_arrays else classes.tolist()
         }
     }
-    
-    # Сохраняем результаты в глобальную переменную
-    last_prediction_results = outputs_dict
+    if roi is not None:
+        crop_height = band["y1"] - band["y0"] if band is not None else height
+        outputs_dict["roi"] = {
+            "applied": band is not None,
+            "y0": band["y0"] if band is not None else 0,
+            "y1": band["y1"] if band is not None else height,
+            "skipped_fraction": 1 - crop_height / height,
+        }
+    if screen is not None:
+        outputs_dict["triage"] = triage
     
     print(f"Обработано изображение: {image_path}")
     
@@ -0,0 +1,197 @@
+import cv2
+import numpy as np
+import torch
+from torchvision.ops import batched_nms
+
+from .inference import predict_batch, instances_to_arrays
+
+MERGE_METHODS = ("nms", "wbf")
+
+
+def tile_positions(length, tile_size, overlap):
+    """
+    Начальные координаты окон вдоль одной оси.
+    Последнее окно прижимается к краю изображения, чтобы не выходить за его пределы.
+    """
+    if length <= tile_size:
+        return [0]
+
+    step = max(tile_size - overlap, 1)
+    positions = list(range(0, length - tile_size, step))
+    positions.append(length - tile_size)
+    return positions
+
+
+def iter_tiles(img, tile_size, overlap):
+    """
+    Генератор окон (x0, y0, tile) скользящего окна по изображению
+    """
+    height, width = img.shape[:2]
+    for y0 in tile_positions(height, tile_size, overlap):
+        for x0 in tile_positions(width, tile_size, overlap):
+            yield x0, y0, img[y0:y0 + tile_size, x0:x0 + tile_size]
+
+
+def to_model_input(tile):
+    """
+    Окно в формате модели: одноканальный снимок расширяется до BGR только
+    для текущего окна, поэтому память под 3 канала зависит от размера окна, а не снимка
+    """
+    if tile.ndim == 2:
+        return cv2.cvtColor(tile, cv2.COLOR_GRAY2BGR)
+    return tile
+
+
+def _box_iou(box, boxes):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-6)
+
+
+def merge_nms(boxes, scores, classes, iou_threshold):
+    """
+    Объединение рамок из соседних окон через NMS с учетом класса
+    """
+    if len(boxes) == 0:
+        return boxes, scores, classes
+
+    keep = batched_nms(
+        torch.from_numpy(boxes),
+        torch.from_numpy(scores),
+        torch.from_numpy(classes),
+        iou_threshold,
+    ).numpy()
+    return boxes[keep], scores[keep], classes[keep]
+
+
+def iou_matrix(a, b):
+    """
+    Попарные IoU рамок a (N x 4) и b (M x 4) - матрица N x M
+    """
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def match_boxes(reference, candidate, iou_threshold):
+    """
+    Жадное сопоставление рамок кандидата с эталонными рамками того же класса;
+    reference и candidate - тройки массивов (рамки, уверенности, классы).
+    Возвращает список пар (IoU, |разница уверенности|).
+    """
+    ref_boxes, ref_scores, ref_classes = reference
+    cand_boxes, cand_scores, cand_classes = candidate
+    if len(ref_boxes) == 0 or len(cand_boxes) == 0:
+        return []
+
+    iou = iou_matrix(ref_boxes, cand_boxes)
+    iou[ref_classes[:, None] != cand_classes[None, :]] = 0
+
+    matches = []
+    used = np.zeros(len(cand_boxes), dtype=bool)
+    for i in np.argsort(-ref_scores):
+        row = np.where(used, 0, iou[i])
+        j = int(np.argmax(row))
+        if row[j] >= iou_threshold:
+            used[j] = True
+            matches.append((float(row[j]), abs(float(ref_scores[i] - cand_scores[j]))))
+    return matches
+
+
+def merge_wbf(boxes, scores, classes, iou_threshold):
+    """
+    Объединение рамок взвешенным слиянием (weighted box fusion):
+    пересекающиеся рамки одного класса усредняются с весами по уверенности.
+    """
+    if len(boxes) == 0:
+        return boxes, scores, classes
+
+    fused_boxes, fused_scores, fused_classes = [], [], []
+    for cls in np.unique(classes):
+        idx = np.where(classes == cls)[0]
+        idx = idx[np.argsort(-scores[idx])]
+        cls_boxes = boxes[idx]
+        cls_scores = scores[idx]
+        used = np.zeros(len(idx), dtype=bool)
+
+        for i in range(len(idx)):
+            if used[i]:
+                continue
+            cluster = (~used) & (_box_iou(cls_boxes[i], cls_boxes) >= iou_threshold)
+            cluster[i] = True
+            used |= cluster
+
+            weights = cls_scores[cluster]
+            fused_boxes.append((cls_boxes[cluster] * weights[:, None]).sum(axis=0) / weights.sum())
+            fused_scores.append(weights.max())
+            fused_classes.append(cls)
+
+    return (
+        np.asarray(fused_boxes, dtype=np.float32).reshape(-1, 4),
+        np.asarray(fused_scores, dtype=np.float32),
+        np.asarray(fused_classes, dtype=np.int64),
+    )
+
+
+def predict_tiled(predictor, img, tile_size=1024, overlap=128, batch_size=4,
+                  merge="nms", iou_threshold=0.5, screen=None, stats=None):
+    """
+    Инференс скользящим окном для сверхшироких снимков.
+    Окна прогоняются пакетами по batch_size, рамки переводятся
+    в координаты исходного изображения и объединяются через NMS или WBF.
+    screen - отсев окон перед моделью (например, TileScreener): окна, для которых
+    он возвращает False, в модель не подаются. В stats (если передан словарь)
+    записывается число окон "tiles" и пропущенных "skipped".
+    Возвращает (boxes, scores, classes) в виде numpy-массивов.
+    """
+    if merge not in MERGE_METHODS:
+        raise ValueError(f"Неизвестный метод объединения рамок: {merge}")
+    if overlap >= tile_size:
+        raise ValueError("Перекрытие окон должно быть меньше размера окна")
+
+    all_boxes, all_scores, all_classes = [], [], []
+    batch, offsets = [], []
+
+    def flush():
+        for (x0, y0), outputs in zip(offsets, predict_batch(predictor, batch)):
+            boxes, scores, classes = instances_to_arrays(outputs["instances"])
+            boxes[:, [0, 2]] += x0
+            boxes[:, [1, 3]] += y0
+            all_boxes.append(boxes)
+            all_scores.append(scores)
+            all_classes.append(classes)
+        batch.clear()
+        offsets.clear()
+
+    tiles = skipped = 0
+    for x0, y0, tile in iter_tiles(img, tile_size, overlap):
+        tiles += 1
+        if screen is not None and not screen(tile):
+            skipped += 1
+            continue
+        batch.append(to_model_input(tile))
+        offsets.append((x0, y0))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    if stats is not None:
+        stats.update(tiles=tiles, skipped=skipped)
+
+    boxes = np.concatenate(all_boxes) if all_boxes else np.zeros((0, 4), dtype=np.float32)
+    scores = np.concatenate(all_scores) if all_scores else np.zeros((0,), dtype=np.float32)
+    classes = np.concatenate(all_classes) if all_classes else np.zeros((0,), dtype=np.int64)
+
+    if merge == "wbf":
+        return merge_wbf(boxes, scores, classes, iou_threshold)
+    return merge_nms(boxes, scores, classes, iou_threshold)
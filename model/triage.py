@@ -0,0 +1,342 @@
+"""
+Отсев пустых окон перед Cascade R-CNN.
+Большая часть окон длинного снимка шва дефектов не содержит; дешевая оценка окна
+по статистикам яркости и контуров позволяет не прогонять такие окна через модель.
+
+Калибровка порога на размеченной выборке:
+    python -m model.triage --samples /data/films --tile-size 1024
+    python -m model.triage --samples /data/films --tile-size 1024 --annotations coco.json --fit triage.json
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+FEATURES = ("std", "edge", "peak")
+# Порог по умолчанию: пиковый отклик в уровнях яркости / вероятность классификатора
+PEAK_THRESHOLD = 8.0
+CLASSIFIER_THRESHOLD = 0.5
+
+
+def load_classifier(path):
+    """
+    Логистический классификатор окон из JSON (результат --fit калибровки)
+    """
+    with open(path) as f:
+        classifier = json.load(f)
+    if list(classifier["features"]) != list(FEATURES):
+        raise ValueError(f"Классификатор обучен на других признаках: {classifier['features']}")
+    return classifier
+
+
+def fit_classifier(features, labels, epochs=2000, learning_rate=0.1):
+    """
+    Логистическая регрессия по признакам окон (градиентный спуск на стандартизованных признаках).
+    labels - 1, если в окне есть дефект по эталону.
+    """
+    features = np.asarray(features, dtype=np.float64)
+    labels = np.asarray(labels, dtype=np.float64)
+    mean = features.mean(axis=0)
+    scale = np.maximum(features.std(axis=0), 1e-6)
+    x = (features - mean) / scale
+
+    # Окон с дефектами мало: классы взвешиваются, чтобы модель не сводилась к "всегда пусто"
+    positives = max(labels.sum(), 1.0)
+    negatives = max(len(labels) - labels.sum(), 1.0)
+    sample_weight = np.where(labels > 0, len(labels) / (2 * positives), len(labels) / (2 * negatives))
+
+    weights = np.zeros(x.shape[1])
+    bias = 0.0
+    for _ in range(epochs):
+        p = 1 / (1 + np.exp(-(x @ weights + bias)))
+        grad = sample_weight * (p - labels)
+        weights -= learning_rate * (x.T @ grad) / len(labels)
+        bias -= learning_rate * grad.mean()
+
+    return {
+        "features": list(FEATURES),
+        "mean": mean.tolist(),
+        "scale": scale.tolist(),
+        "weights": weights.tolist(),
+        "bias": float(bias),
+    }
+
+
+class TileScreener:
+    """
+    Дешевая оценка окна: есть ли смысл прогонять его через модель.
+    Признаки окна - стандартное отклонение яркости (std), средний и пиковый отклик
+    полосового фильтра (edge, peak): поры, включения и трещины - локальные отклонения
+    от сглаженного фона шва. Фильтр - разность размытий окнами smooth_size и blur_size:
+    мелкое размытие подавляет зерно пленки, крупное дает фон. peak - отклик, который
+    превышают не меньше peak_pixels пикселей, поэтому его дает даже одна небольшая пора.
+    Без классификатора оценка окна - peak (в уровнях яркости), с классификатором -
+    его вероятность дефекта. Окна с оценкой ниже threshold пропускаются; без threshold
+    берется порог, сохраненный калибровкой в классификаторе, или порог по умолчанию для режима.
+    """
+
+    def __init__(self, threshold=None, classifier=None, smooth_size=3, blur_size=15, peak_pixels=32):
+        if threshold is None:
+            threshold = classifier.get("threshold", CLASSIFIER_THRESHOLD) if classifier else PEAK_THRESHOLD
+        if classifier is not None and not 0 <= threshold <= 1:
+            raise ValueError(f"Порог отсева с классификатором - вероятность от 0 до 1, получено {threshold}")
+        self.threshold = threshold
+        self.classifier = classifier
+        self.smooth_size = smooth_size
+        self.blur_size = blur_size
+        self.peak_pixels = peak_pixels
+
+    def features(self, tile):
+        """
+        Признаки окна в порядке FEATURES (окно - одноканальное или BGR)
+        """
+        if tile.ndim == 3:
+            tile = cv2.cvtColor(tile, cv2.COLOR_BGR2GRAY)
+        _, std = cv2.meanStdDev(tile)
+        residual = cv2.absdiff(
+            cv2.blur(tile, (self.smooth_size, self.smooth_size)),
+            cv2.blur(tile, (self.blur_size, self.blur_size)),
+        )
+        # Пик по гистограмме uint8 - один линейный проход без сортировки
+        above = np.cumsum(np.bincount(residual.ravel(), minlength=256)[::-1])
+        peak = 255 - int(np.searchsorted(above, min(self.peak_pixels, above[-1])))
+        return np.array([float(std[0, 0]), float(cv2.mean(residual)[0]), float(peak)])
+
+    def score_features(self, features):
+        if self.classifier is None:
+            return float(features[FEATURES.index("peak")])
+        c = self.classifier
+        z = (np.asarray(features) - c["mean"]) / np.asarray(c["scale"])
+        return float(1 / (1 + np.exp(-(z @ np.asarray(c["weights"]) + c["bias"]))))
+
+    def score(self, tile):
+        return self.score_features(self.features(tile))
+
+    def __call__(self, tile):
+        """
+        True - окно нужно прогнать через модель
+        """
+        return self.score(tile) >= self.threshold
+
+    def identity(self):
+        """
+        Параметры отсева для ключа кэша предсказаний
+        """
+        return {
+            "threshold": self.threshold,
+            "classifier": self.classifier,
+            "smooth_size": self.smooth_size,
+            "blur_size": self.blur_size,
+            "peak_pixels": self.peak_pixels,
+        }
+
+
+def _load_annotations(path):
+    """
+    Эталонные рамки из COCO JSON: {имя файла: массив x1, y1, x2, y2}
+    """
+    with open(path) as f:
+        coco = json.load(f)
+    names = {image["id"]: os.path.basename(image["file_name"]) for image in coco["images"]}
+    boxes = {name: [] for name in names.values()}
+    for ann in coco["annotations"]:
+        x, y, w, h = ann["bbox"]
+        boxes[names[ann["image_id"]]].append([x, y, x + w, y + h])
+    return {name: np.asarray(b, dtype=np.float32).reshape(-1, 4) for name, b in boxes.items()}
+
+
+def _recall(reference, boxes, iou_threshold):
+    """
+    Количество эталонных рамок, найденных среди boxes (без учета класса), и их общее число
+    """
+    from model.tiling import match_boxes
+
+    if len(reference) == 0:
+        return 0, 0
+    ref = (reference, np.ones(len(reference), dtype=np.float32), np.zeros(len(reference), dtype=np.int64))
+    cand = (boxes, np.ones(len(boxes), dtype=np.float32), np.zeros(len(boxes), dtype=np.int64))
+    return len(match_boxes(ref, cand, iou_threshold)), len(reference)
+
+
+def collect_tiles(predictor, images, tile_size, overlap, screener):
+    """
+    Прогон всех окон выборки через оценку и полную модель.
+    Возвращает по каждому снимку список окон: границы окна, признаки, рамки модели
+    (в координатах снимка) и время оценки и модели.
+    """
+    from model.inference import predict_batch, instances_to_arrays
+    from model.tiling import iter_tiles, to_model_input
+
+    samples = []
+    for name, img in images:
+        tiles = []
+        for x0, y0, tile in iter_tiles(img, tile_size, overlap):
+            start = time.perf_counter()
+            features = screener.features(tile)
+            screen_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            outputs = predict_batch(predictor, [to_model_input(tile)])[0]
+            model_time = time.perf_counter() - start
+
+            boxes, scores, classes = instances_to_arrays(outputs["instances"])
+            boxes[:, [0, 2]] += x0
+            boxes[:, [1, 3]] += y0
+            tiles.append({
+                "window": (x0, y0, x0 + tile.shape[1], y0 + tile.shape[0]),
+                "features": features, "boxes": boxes, "scores": scores, "classes": classes,
+                "screen_time": screen_time, "model_time": model_time,
+            })
+        samples.append((name, tiles))
+    return samples
+
+
+def tile_labels(samples, annotations=None):
+    """
+    Метки окон для обучения классификатора: 1 - в окне есть дефект.
+    Без разметки - модель нашла в окне хотя бы одну рамку, с разметкой - в окне лежит
+    центр хотя бы одной эталонной рамки.
+    """
+    labels = []
+    for name, tiles in samples:
+        reference = annotations.get(name, np.zeros((0, 4), dtype=np.float32)) if annotations else None
+        for t in tiles:
+            if reference is None:
+                labels.append(int(len(t["boxes"]) > 0))
+                continue
+            x0, y0, x1, y1 = t["window"]
+            cx = (reference[:, 0] + reference[:, 2]) / 2
+            cy = (reference[:, 1] + reference[:, 3]) / 2
+            labels.append(int(np.any((cx >= x0) & (cx < x1) & (cy >= y0) & (cy < y1))))
+    return labels
+
+
+def _merged(tiles, iou_threshold=0.5):
+    from model.tiling import merge_nms
+
+    if not tiles:
+        return np.zeros((0, 4), dtype=np.float32)
+    boxes, _, _ = merge_nms(
+        np.concatenate([t["boxes"] for t in tiles]),
+        np.concatenate([t["scores"] for t in tiles]),
+        np.concatenate([t["classes"] for t in tiles]),
+        iou_threshold,
+    )
+    return boxes
+
+
+def calibrate(samples, screener, thresholds, annotations=None, iou_threshold=0.5):
+    """
+    Потери полноты и ускорение для каждого порога.
+    Эталон - рамки полной модели по всем окнам либо разметка annotations;
+    во втором случае recall_lost - потеря относительно полной модели на той же разметке.
+    Ускорение - время модели по всем окнам к времени оценки всех окон и модели по оставленным.
+    """
+    scored = [(name, [(screener.score_features(t["features"]), t) for t in tiles]) for name, tiles in samples]
+    model_time = sum(t["model_time"] for _, tiles in samples for t in tiles)
+    screen_time = sum(t["screen_time"] for _, tiles in samples for t in tiles)
+    total_tiles = sum(len(tiles) for _, tiles in samples)
+
+    references = {}
+    full_found = full_total = 0
+    for name, tiles in samples:
+        full = _merged(tiles, iou_threshold)
+        references[name] = annotations.get(name, np.zeros((0, 4), dtype=np.float32)) if annotations else full
+        found, total = _recall(references[name], full, iou_threshold)
+        full_found += found
+        full_total += total
+    full_recall = full_found / full_total if full_total else 1.0
+
+    rows = []
+    for threshold in thresholds:
+        found = kept = 0
+        kept_time = 0.0
+        for name, tiles in scored:
+            kept_tiles = [t for score, t in tiles if score >= threshold]
+            kept += len(kept_tiles)
+            kept_time += sum(t["model_time"] for t in kept_tiles)
+            found += _recall(references[name], _merged(kept_tiles, iou_threshold), iou_threshold)[0]
+        recall = found / full_total if full_total else 1.0
+        rows.append({
+            "threshold": threshold,
+            "kept_tiles": kept,
+            "skipped_fraction": 1 - kept / total_tiles if total_tiles else 0.0,
+            "recall": recall,
+            "recall_lost": full_recall - recall,
+            "speedup": model_time / (screen_time + kept_time) if screen_time + kept_time else None,
+        })
+
+    return {
+        "images": len(samples),
+        "tiles": total_tiles,
+        "reference_boxes": full_total,
+        "reference": "annotations" if annotations else "model",
+        "full_model_recall": full_recall,
+        "screen_ms_per_tile": screen_time / total_tiles * 1000 if total_tiles else None,
+        "model_ms_per_tile": model_time / total_tiles * 1000 if total_tiles else None,
+        "thresholds": rows,
+    }
+
+
+def default_thresholds(samples, screener, steps=10):
+    """
+    Пороги сетки - квантили оценок окон выборки (от 0 до 90% пропущенных окон)
+    """
+    scores = [screener.score_features(t["features"]) for _, tiles in samples for t in tiles]
+    if not scores:
+        return []
+    return sorted({float(np.quantile(scores, q)) for q in np.linspace(0, 0.9, steps)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Калибровка отсева пустых окон по полной модели")
+    parser.add_argument("--model", default="/app/model/utils/model.pth")
+    parser.add_argument("--samples", required=True, help="Директория с PNG-снимками")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--tile-size", type=int, default=1024)
+    parser.add_argument("--tile-overlap", type=int, default=128)
+    parser.add_argument("--annotations", default=None, help="Разметка COCO JSON (по умолчанию эталон - полная модель)")
+    parser.add_argument("--classifier", default=None, help="Классификатор окон из JSON")
+    parser.add_argument("--fit", default=None, help="Обучить классификатор окон и сохранить в JSON")
+    parser.add_argument("--thresholds", type=float, nargs="*", default=None)
+    parser.add_argument("--iou", type=float, default=0.5)
+    parser.add_argument("--min-recall", type=float, default=0.99,
+                        help="Минимальная полнота относительно эталона для рекомендуемого порога")
+    args = parser.parse_args()
+
+    from model.decoding import decode_gray
+    from model.process_image import setup_model
+
+    paths = sorted(glob.glob(os.path.join(args.samples, "*.png")))[:args.limit]
+    images = [(os.path.basename(path), decode_gray(path)) for path in paths]
+    images = [(name, img) for name, img in images if img is not None]
+
+    screener = TileScreener(classifier=load_classifier(args.classifier) if args.classifier else None)
+    samples = collect_tiles(setup_model(args.model), images, args.tile_size, args.tile_overlap, screener)
+    annotations = _load_annotations(args.annotations) if args.annotations else None
+
+    if args.fit:
+        features = [t["features"] for _, tiles in samples for t in tiles]
+        screener.classifier = fit_classifier(features, tile_labels(samples, annotations))
+
+    thresholds = args.thresholds or default_thresholds(samples, screener)
+    report = calibrate(samples, screener, thresholds, annotations, args.iou)
+    safe = [row for row in report["thresholds"]
+            if report["reference_boxes"] and row["recall"] >= args.min_recall * report["full_model_recall"]]
+    report["recommended_threshold"] = max((row["threshold"] for row in safe), default=None)
+
+    if args.fit:
+        # Откалиброванный порог сохраняется вместе с классификатором и используется без TRIAGE_THRESHOLD
+        if report["recommended_threshold"] is not None:
+            screener.classifier["threshold"] = report["recommended_threshold"]
+        with open(args.fit, "w") as f:
+            json.dump(screener.classifier, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
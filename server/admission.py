@@ -0,0 +1,145 @@
+import asyncio
+import os
+from collections import deque
+from contextlib import asynccontextmanager
+
+from model.decoding import decode_memory, png_header
+
+# Каналов у входа модели (BGR)
+MODEL_CHANNELS = 3
+
+
+class MemoryBudgetExceeded(Exception):
+    """
+    Снимок не поместится в бюджет памяти узла даже без других запросов
+    """
+
+
+class MemoryWaitTimeout(Exception):
+    """
+    Память под снимок не освободилась за отведенное время
+    """
+
+
+def detect_memory_limit():
+    """
+    Доступная процессу память: лимит cgroup контейнера (v2 или v1), иначе физическая память
+    """
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # "max" и огромные значения v1 означают отсутствие лимита
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def inference_memory(header, tile_size=0, tile_batch_size=4):
+    """
+    Оценка пиковой памяти поиска дефектов на снимке с заголовком PNG header, в байтах:
+    декодирование плюс вход модели - BGR-копия всего снимка или пакета окон при инференсе окнами
+    """
+    width, height = header["width"], header["height"]
+    model_input = width * height * MODEL_CHANNELS
+    if tile_size and max(width, height) > tile_size:
+        model_input = min(model_input, min(width, tile_size) * min(height, tile_size) * MODEL_CHANNELS * tile_batch_size)
+    return decode_memory(header) + model_input
+
+
+class MemoryBudget:
+    """
+    Бюджет памяти узла под декодирование и инференс снимков.
+    Запрос резервирует оценку памяти своего снимка: помещающиеся в остаток бюджета
+    допускаются сразу, остальные ждут в порядке очереди, пока память не освободится;
+    снимок больше всего бюджета отклоняется без ожидания.
+    Используется из одного цикла событий.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self.in_use = 0
+        self._waiters = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def check(self, amount):
+        """
+        Отказ без ожидания, если amount больше всего бюджета
+        """
+        if amount > self.capacity:
+            self.rejected += 1
+            raise MemoryBudgetExceeded(
+                f"Для обработки снимка нужно {amount >> 20} МБ памяти, бюджет узла - {self.capacity >> 20} МБ"
+            )
+
+    async def acquire(self, amount, timeout=None):
+        self.check(amount)
+        if not self._waiters and self.in_use + amount <= self.capacity:
+            self.in_use += amount
+            self.admitted += 1
+            return
+
+        self.queued += 1
+        waiter = (amount, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[1]), timeout)
+        except BaseException as e:
+            if waiter[1].done() and not waiter[1].cancelled():
+                # Память уже выделена, но запрос прерван: возвращаем ее
+                self.release(amount)
+            else:
+                waiter[1].cancel()
+                self._waiters.remove(waiter)
+                # Ушедший из головы очереди запрос мог задерживать следующие
+                self._wake()
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                raise MemoryWaitTimeout("Превышено время ожидания памяти под снимок") from None
+            raise
+        self.admitted += 1
+
+    def release(self, amount):
+        self.in_use -= amount
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_use + self._waiters[0][0] <= self.capacity:
+            amount, future = self._waiters.popleft()
+            self.in_use += amount
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def reserve(self, amount, timeout=None):
+        await self.acquire(amount, timeout)
+        try:
+            yield
+        finally:
+            self.release(amount)
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "waiting": len(self._waiters),
+            "waiting_bytes": sum(amount for amount, _ in self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+
+def image_cost(data, tile_size=0, tile_batch_size=4):
+    """
+    Оценка памяти под снимок по заголовку PNG без декодирования (None - не PNG)
+    """
+    header = png_header(data)
+    if header is None:
+        return None
+    return inference_memory(header, tile_size, tile_batch_size)
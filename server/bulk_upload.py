@@ -0,0 +1,100 @@
+import asyncio
+import os
+import zipfile
+
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed", "multipart/x-zip")
+
+
+class BulkUploadError(Exception):
+    """
+    Ошибка отдельного файла пакетной загрузки (в ответ попадает строкой с полем error)
+    """
+
+
+def is_zip_upload(file):
+    return file.content_type in ZIP_CONTENT_TYPES or (file.filename or "").lower().endswith(".zip")
+
+
+def is_png_entry(info):
+    """
+    PNG-файл архива; каталоги и служебные файлы macOS (__MACOSX, ._*) пропускаются
+    """
+    name = info.filename
+    return (
+        not info.is_dir()
+        and name.lower().endswith(".png")
+        and "__MACOSX/" not in name
+        and not os.path.basename(name).startswith("._")
+    )
+
+
+async def read_upload(file, max_size, chunk_size):
+    """
+    Чтение PNG из multipart-загрузки с проверкой размера
+    """
+    data = bytearray()
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            return data
+        if len(data) + len(chunk) > max_size:
+            raise BulkUploadError(f"Размер файла превышает {max_size // (1024 * 1024)}MB")
+        data += chunk
+
+
+def read_entry(archive, info, max_size):
+    """
+    Распаковка элемента архива; размер из заголовка не проверяется на честность,
+    поэтому чтение ограничено max_size байт
+    """
+    with archive.open(info) as entry:
+        data = entry.read(max_size + 1)
+    if len(data) > max_size:
+        raise BulkUploadError(f"Размер файла превышает {max_size // (1024 * 1024)}MB")
+    return data
+
+
+async def iter_uploaded_pngs(files, max_files, max_size, chunk_size):
+    """
+    Снимки из загруженных PNG и ZIP-архивов по одному: (имя, содержимое или исключение).
+    Архив читается по элементам, поэтому в памяти одновременно находится один распакованный
+    снимок, а размер элемента проверяется по заголовку архива до распаковки.
+    """
+    count = 0
+
+    def limit_reached():
+        nonlocal count
+        count += 1
+        return count > max_files
+
+    for file in files:
+        if not is_zip_upload(file):
+            if limit_reached():
+                yield file.filename, BulkUploadError(f"Превышено количество файлов в запросе ({max_files})")
+                return
+            try:
+                yield file.filename, await read_upload(file, max_size, chunk_size)
+            except BulkUploadError as e:
+                yield file.filename, e
+            continue
+
+        try:
+            archive = await asyncio.to_thread(zipfile.ZipFile, file.file)
+        except zipfile.BadZipFile:
+            yield file.filename, BulkUploadError("Поврежденный ZIP-архив")
+            continue
+
+        with archive:
+            for info in filter(is_png_entry, archive.infolist()):
+                if limit_reached():
+                    yield info.filename, BulkUploadError(f"Превышено количество файлов в запросе ({max_files})")
+                    return
+                if info.file_size > max_size:
+                    yield info.filename, BulkUploadError(f"Размер файла превышает {max_size // (1024 * 1024)}MB")
+                    continue
+                try:
+                    yield info.filename, await asyncio.to_thread(read_entry, archive, info, max_size)
+                except BulkUploadError as e:
+                    yield info.filename, e
+                except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError, RuntimeError) as e:
+                    yield info.filename, BulkUploadError(f"Не удалось распаковать файл: {e}")
@@ -1,4 +1,123 @@
+import os
+
 host = "127.0.0.1"
 user = "postgres"
 password = "5504"
 db_name = "users"
+
+# Веса модели и каталог загруженных снимков (общий для API и воркеров очереди)
+MODEL_PATH = os.getenv("MODEL_PATH", "/app/model/utils/model.pth")
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/app/server/images")
+
+# Инференс скользящим окном (0 - отключен, снимок подается в модель целиком)
+TILE_SIZE = int(os.getenv("TILE_SIZE", "0"))
+TILE_OVERLAP = int(os.getenv("TILE_OVERLAP", "128"))
+TILE_BATCH_SIZE = int(os.getenv("TILE_BATCH_SIZE", "4"))
+TILE_MERGE = os.getenv("TILE_MERGE", "nms")
+
+# Обрезка снимка до полосы сварного шва перед моделью (0 - отключена).
+# Запас - доля высоты полосы с каждой стороны (не меньше SEAM_ROI_MIN_MARGIN px);
+# при контрасте полосы ниже SEAM_ROI_MIN_CONTRAST или полосе шире SEAM_ROI_MAX_FRACTION
+# высоты снимка модель получает весь снимок
+SEAM_ROI = os.getenv("SEAM_ROI", "0").lower() in ("1", "true", "yes")
+SEAM_ROI_MARGIN = float(os.getenv("SEAM_ROI_MARGIN", "0.25"))
+SEAM_ROI_MIN_MARGIN = int(os.getenv("SEAM_ROI_MIN_MARGIN", "64"))
+SEAM_ROI_MIN_CONTRAST = float(os.getenv("SEAM_ROI_MIN_CONTRAST", "8"))
+SEAM_ROI_MAX_FRACTION = float(os.getenv("SEAM_ROI_MAX_FRACTION", "0.5"))
+
+# Отсев пустых окон перед моделью при инференсе окнами (0 - отключен).
+# Окна с оценкой ниже TRIAGE_THRESHOLD не подаются в модель; оценка - пиковый высокочастотный
+# отклик в уровнях яркости или вероятность классификатора TRIAGE_CLASSIFIER (python -m model.triage --fit).
+# Без TRIAGE_THRESHOLD - 8 для пикового отклика или порог, сохраненный калибровкой в классификаторе
+TRIAGE = os.getenv("TRIAGE", "0").lower() in ("1", "true", "yes")
+TRIAGE_THRESHOLD = float(os.environ["TRIAGE_THRESHOLD"]) if os.getenv("TRIAGE_THRESHOLD") else None
+TRIAGE_CLASSIFIER = os.getenv("TRIAGE_CLASSIFIER", "")
+
+# Динамическое объединение запросов в пакеты (1 - отключено)
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "1"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+
+# Пул воркеров инференса
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+INFERENCE_POOL_MODE = os.getenv("INFERENCE_POOL_MODE", "thread")
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "8"))
+TORCH_THREADS_PER_WORKER = int(os.getenv("TORCH_THREADS_PER_WORKER", "0")) or None
+INFERENCE_RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "5"))
+
+# Загрузка модели: MODEL_PRELOAD=1 - в родительском процессе до fork (gunicorn --preload),
+# иначе в фоне после старта; прогрев пустым снимком MODEL_WARMUP_SIZE x MODEL_WARMUP_SIZE (0 - без прогрева)
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "0").lower() in ("1", "true", "yes")
+MODEL_WARMUP_SIZE = int(os.getenv("MODEL_WARMUP_SIZE", "1024"))
+MODEL_RETRY_AFTER = int(os.getenv("MODEL_RETRY_AFTER", "10"))
+
+# Очередь инференса: local - модель в процессе API, db - задачи в таблице inference_tasks,
+# которые выполняют отдельные воркеры (python -m server.worker); снимки берутся из общего UPLOAD_DIR
+INFERENCE_QUEUE = os.getenv("INFERENCE_QUEUE", "local")
+QUEUE_LEASE_SECONDS = int(os.getenv("QUEUE_LEASE_SECONDS", "120"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+QUEUE_RETRY_BACKOFF = float(os.getenv("QUEUE_RETRY_BACKOFF", "5"))
+QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "0.5"))
+QUEUE_WAIT_TIMEOUT = float(os.getenv("QUEUE_WAIT_TIMEOUT", "120"))
+
+# Хранилище задач инференса
+JOB_STORE_MAX_JOBS = int(os.getenv("JOB_STORE_MAX_JOBS", "1000"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "60"))
+JOB_RETRY_INTERVAL = float(os.getenv("JOB_RETRY_INTERVAL", "0.5"))
+
+# Каталог для временных файлов, в которые декодируются снимки (пусто - в памяти процесса).
+# Отображенный в память файл может вытесняться ОС, что полезно для очень длинных снимков
+# при инференсе окнами (TILE_SIZE) в пуле потоков
+DECODE_SPILL_DIR = os.getenv("DECODE_SPILL_DIR", "")
+
+# Кэш предсказаний (0 - отключен; пустой PREDICTION_CACHE_DIR - только в памяти)
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "256"))
+PREDICTION_CACHE_DIR = os.getenv("PREDICTION_CACHE_DIR", "/app/server/cache")
+
+# Бэкенд инференса: eager, quantized, torchscript или onnx
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager")
+EXPORT_DIR = os.getenv("EXPORT_DIR", "/app/model/exported")
+
+# Гистограммное выравнивание снимков по эталону перед моделью (пусто - отключено)
+HISTOGRAM_REFERENCE = os.getenv("HISTOGRAM_REFERENCE", "")
+
+# Процессы построения PDF-отчетов (0 - в потоке основного процесса)
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+REPORT_BATCH_MAX = int(os.getenv("REPORT_BATCH_MAX", "50"))
+
+# Пакетная загрузка POST /upload/bulk: файлов в запросе и снимков в обработке одновременно
+BULK_UPLOAD_MAX_FILES = int(os.getenv("BULK_UPLOAD_MAX_FILES", "200"))
+BULK_UPLOAD_CONCURRENCY = int(os.getenv("BULK_UPLOAD_CONCURRENCY", "4"))
+
+# Бюджет памяти под декодирование и инференс снимков на процесс сервера, МБ.
+# 0 - MEMORY_BUDGET_FRACTION лимита памяти контейнера (или всей памяти машины),
+# поделенная на WEB_CONCURRENCY процессов. Снимок, не помещающийся в остаток бюджета,
+# ждет до MEMORY_WAIT_TIMEOUT секунд; больше всего бюджета - сразу отклоняется
+MEMORY_BUDGET_MB = int(os.getenv("MEMORY_BUDGET_MB", "0"))
+MEMORY_BUDGET_FRACTION = float(os.getenv("MEMORY_BUDGET_FRACTION", "0.6"))
+MEMORY_WAIT_TIMEOUT = float(os.getenv("MEMORY_WAIT_TIMEOUT", "30"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Пул соединений с базой данных (на каждый процесс сервера)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+
+# Пирамиды тайлов Deep Zoom и миниатюры загруженных снимков
+PYRAMID_TILE_SIZE = int(os.getenv("PYRAMID_TILE_SIZE", "254"))
+PYRAMID_TILE_OVERLAP = int(os.getenv("PYRAMID_TILE_OVERLAP", "1"))
+PYRAMID_JPEG_QUALITY = int(os.getenv("PYRAMID_JPEG_QUALITY", "85"))
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "1024"))
+PYRAMID_WORKERS = int(os.getenv("PYRAMID_WORKERS", "1"))
+
+# Постраничная выдача GET /users/
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", "100"))
+USERS_MAX_PAGE_SIZE = int(os.getenv("USERS_MAX_PAGE_SIZE", "500"))
+
+# Уровень логирования (полные результаты модели пишутся только на DEBUG)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Заголовок Server-Timing с длительностью этапов в каждом ответе
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0").lower() in ("1", "true", "yes")
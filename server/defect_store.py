@@ -0,0 +1,126 @@
+import numpy as np
+from sqlalchemy import and_, case, delete, func, insert, or_, select
+
+from .model import Defect, Image
+from .pdf_generator import BELT_START, SEGMENT_LENGTH, SEGMENT_COUNT
+from .user_listing import encode_cursor
+
+# Участок стыка пояса: x1 до начала пояса или за его концом
+SEGMENT_JOINT = SEGMENT_COUNT
+BELT_END = BELT_START + SEGMENT_COUNT * SEGMENT_LENGTH
+
+
+def defect_rows(image_id, result):
+    """
+    Строки таблицы defects из результата модели (списки или numpy-массивы)
+    """
+    if not result:
+        return []
+    instances = result["instances"]
+    boxes = np.asarray(instances["pred_boxes"], dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(instances["scores"], dtype=np.float64)
+    classes = np.asarray(instances["pred_classes"], dtype=np.int64)
+    return [
+        {"image_id": image_id, "class_id": int(cls), "score": float(score),
+         "x1": float(x1), "y1": float(y1), "x2": float(x2), "y2": float(y2)}
+        for (x1, y1, x2, y2), score, cls in zip(boxes.tolist(), scores.tolist(), classes.tolist())
+    ]
+
+
+async def replace_defects(db, image_id, result):
+    """
+    Заменяет сохраненные дефекты снимка результатом модели (commit - на вызывающей стороне)
+    """
+    await db.execute(delete(Defect).where(Defect.image_id == image_id))
+    rows = defect_rows(image_id, result)
+    if rows:
+        await db.execute(insert(Defect), rows)
+    return len(rows)
+
+
+def segment_of(x1):
+    """
+    Участок мерного пояса по x1: 0..SEGMENT_COUNT-1 - участки пояса, SEGMENT_JOINT - стык.
+    В отличие от таблицы отчета, границы полуоткрытые: каждый дефект попадает ровно в один участок.
+    """
+    if x1 < BELT_START or x1 >= BELT_END:
+        return SEGMENT_JOINT
+    return int((x1 - BELT_START) // SEGMENT_LENGTH)
+
+
+def segment_expression():
+    """
+    SQL-выражение участка по x1, совпадающее с segment_of
+    """
+    whens = [(Defect.x1 < BELT_START, SEGMENT_JOINT)]
+    whens += [(Defect.x1 < BELT_START + (i + 1) * SEGMENT_LENGTH, i) for i in range(SEGMENT_COUNT)]
+    return case(*whens, else_=SEGMENT_JOINT)
+
+
+def segment_condition(segment):
+    """
+    Условие на участок диапазоном по x1 (использует индекс ix_defects_x1_x2)
+    """
+    if segment == SEGMENT_JOINT:
+        return or_(Defect.x1 < BELT_START, Defect.x1 >= BELT_END)
+    low = BELT_START + segment * SEGMENT_LENGTH
+    return and_(Defect.x1 >= low, Defect.x1 < low + SEGMENT_LENGTH)
+
+
+def filter_defects(query, user_id=None, image_id=None, filename=None, class_ids=None, min_score=None, segment=None):
+    """
+    Фильтры выборки дефектов; query должен включать соединение с images
+    """
+    if user_id is not None:
+        query = query.where(Image.user_id == user_id)
+    if image_id is not None:
+        query = query.where(Defect.image_id == image_id)
+    if filename is not None:
+        query = query.where(Image.filename == filename)
+    if class_ids:
+        query = query.where(Defect.class_id.in_(class_ids))
+    if min_score:
+        query = query.where(Defect.score >= min_score)
+    if segment is not None:
+        query = query.where(segment_condition(segment))
+    return query
+
+
+async def query_defects(db, after_id=None, limit=100, **filters):
+    """
+    Страница дефектов с id больше after_id (keyset-пагинация).
+    Возвращает (записи, курсор следующей страницы или None).
+    """
+    query = select(
+        Defect.id, Image.filename, Defect.class_id, Defect.score,
+        Defect.x1, Defect.y1, Defect.x2, Defect.y2,
+    ).join(Image, Image.id == Defect.image_id).order_by(Defect.id)
+    query = filter_defects(query, **filters)
+    if after_id is not None:
+        query = query.where(Defect.id > after_id)
+
+    rows = (await db.execute(query.limit(limit + 1))).all()
+    items = [
+        {"id": row.id, "filename": row.filename, "classId": row.class_id, "score": row.score,
+         "x1": row.x1, "y1": row.y1, "x2": row.x2, "y2": row.y2, "segment": segment_of(row.x1)}
+        for row in rows[:limit]
+    ]
+    next_cursor = encode_cursor(items[-1]["id"]) if len(rows) > limit else None
+    return items, next_cursor
+
+
+async def defect_stats(db, **filters):
+    """
+    Количество дефектов по участкам пояса и классам - один запрос с группировкой
+    """
+    segment = segment_expression().label("segment")
+    query = select(segment, Defect.class_id, func.count(Defect.id)).join(Image, Image.id == Defect.image_id)
+    query = filter_defects(query, **filters).group_by(segment, Defect.class_id)
+
+    segments = [{"segment": i, "classes": {}, "total": 0} for i in range(SEGMENT_COUNT + 1)]
+    total = 0
+    for segment_index, class_id, count in await db.execute(query):
+        segments[segment_index]["classes"][class_id] = count
+        segments[segment_index]["total"] += count
+        total += count
+    return {"total": total, "segments": segments}
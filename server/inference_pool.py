@@ -0,0 +1,142 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from model.batching import BatchingPredictor
+from model.backends import create_backend
+
+POOL_MODES = ("thread", "process")
+
+# Реплика модели текущего воркера (поток или процесс пула)
+_local = threading.local()
+
+
+class PoolFullError(Exception):
+    """
+    Очередь пула инференса заполнена
+    """
+
+
+def build_predictor(model_path, batch_max_size=1, batch_max_wait_ms=10,
+                    backend="eager", export_dir=None, predictor=None):
+    """
+    Создает реплику модели выбранного бэкенда, при необходимости с пакетной обработкой запросов.
+    Уже загруженная модель (predictor) используется вместо новой реплики.
+    """
+    if predictor is None:
+        predictor = create_backend(backend, model_path, export_dir)
+    if batch_max_size > 1:
+        predictor = BatchingPredictor(predictor, batch_max_size, batch_max_wait_ms)
+    return predictor
+
+
+def _set_torch_threads(num_threads):
+    import torch
+
+    torch.set_num_threads(num_threads)
+
+
+def _init_worker(factory, factory_args, num_threads):
+    if num_threads:
+        _set_torch_threads(num_threads)
+    _local.predictor = factory(*factory_args)
+
+
+def _call_with_predictor(fn, args, kwargs):
+    return fn(_local.predictor, *args, **kwargs)
+
+
+class InferencePool:
+    """
+    Пул воркеров инференса, каждый со своей репликой модели.
+    Длина очереди ограничена: при переполнении submit сразу выбрасывает PoolFullError.
+    Число потоков torch задается на процесс: в режиме process у каждого воркера свои
+    threads_per_worker потоков, в режиме thread воркеры делят общий пул из
+    workers * threads_per_worker потоков.
+    """
+
+    def __init__(self, factory, factory_args=(), workers=1, mode="thread",
+                 queue_size=8, threads_per_worker=None):
+        if mode not in POOL_MODES:
+            raise ValueError(f"Неизвестный режим пула инференса: {mode}")
+
+        self.workers = max(int(workers), 1)
+        self.mode = mode
+        self.queue_size = max(int(queue_size), 0)
+        if threads_per_worker is None:
+            threads_per_worker = max((os.cpu_count() or 1) // self.workers, 1)
+        self.threads_per_worker = threads_per_worker
+
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        if mode == "process":
+            self.torch_threads = threads_per_worker
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(factory, tuple(factory_args), threads_per_worker),
+            )
+        else:
+            # torch.set_num_threads действует на весь процесс, поэтому задается один раз
+            self.torch_threads = self.workers * threads_per_worker
+            _set_torch_threads(self.torch_threads)
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="inference",
+                initializer=_init_worker,
+                initargs=(factory, tuple(factory_args), None),
+            )
+
+    @property
+    def capacity(self):
+        return self.workers + self.queue_size
+
+    def is_full(self):
+        with self._lock:
+            return self._pending >= self.capacity
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Ставит fn(predictor, *args, **kwargs) в очередь пула, возвращает concurrent Future
+        """
+        with self._lock:
+            if self._pending >= self.capacity:
+                raise PoolFullError("Очередь инференса заполнена")
+            self._pending += 1
+
+        try:
+            future = self._executor.submit(_call_with_predictor, fn, args, kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Выполняет fn в пуле, не блокируя цикл событий
+        """
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def stats(self):
+        with self._lock:
+            pending = self._pending
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "threads_per_worker": self.threads_per_worker,
+            "torch_threads": self.torch_threads,
+            "queue_size": self.queue_size,
+            "pending": pending,
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+FINISHED_STATUSES = (JOB_DONE, JOB_FAILED)
+
+
+class JobStoreFullError(Exception):
+    """
+    В хранилище нет места под новую задачу: все задачи еще не завершены
+    """
+
+
+class Job:
+    def __init__(self, user_id, filename):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.filename = filename
+        self.status = JOB_QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._done = asyncio.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self):
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "defects": self.result,
+            "error": self.error,
+            "createdAt": self.created_at,
+            "finishedAt": self.finished_at,
+        }
+
+
+class JobStore:
+    """
+    Хранилище задач инференса с ограничением по количеству и TTL.
+    Завершенные задачи удаляются по истечении ttl_seconds, а при переполнении -
+    начиная с самых старых завершенных.
+    """
+
+    def __init__(self, max_jobs=1000, ttl_seconds=3600):
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, user_id, filename):
+        with self._lock:
+            self._evict()
+            if len(self._jobs) >= self.max_jobs:
+                raise JobStoreFullError("Превышено количество задач в очереди")
+            job = Job(user_id, filename)
+            self._jobs[job.id] = job
+            return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._evict()
+            return self._jobs.get(job_id)
+
+    def start(self, job):
+        job.status = JOB_RUNNING
+
+    def finish(self, job, result):
+        job.result = result
+        self._complete(job, JOB_DONE)
+
+    def fail(self, job, error):
+        job.error = error
+        self._complete(job, JOB_FAILED)
+
+    def discard(self, job):
+        """
+        Удаляет задачу отклоненного запроса: клиент повторит загрузку, и задача не нужна
+        """
+        with self._lock:
+            self._jobs.pop(job.id, None)
+
+    def _complete(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        job._done.set()
+
+    def latest_result(self, user_id):
+        """
+        Результат последней успешно завершенной задачи пользователя среди еще хранящихся:
+        после удаления задачи по TTL или при переполнении ее результат не возвращается
+        """
+        with self._lock:
+            self._evict()
+            done = [job for job in self._jobs.values() if job.user_id == user_id and job.status == JOB_DONE]
+        if not done:
+            return None
+        return max(done, key=lambda job: job.finished_at).result
+
+    async def wait(self, job, timeout):
+        """
+        Ожидает завершения задачи не дольше timeout секунд
+        """
+        try:
+            await asyncio.wait_for(job._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    def _evict(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and now - job.finished_at > self.ttl_seconds
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+        if len(self._jobs) < self.max_jobs:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished]:
+            del self._jobs[job_id]
+            if len(self._jobs) < self.max_jobs:
+                return
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)}
@@ -0,0 +1,54 @@
+import atexit
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+_queue_handler = None
+_stream_handler = None
+
+
+def _start_listener():
+    """
+    Новая очередь и поток QueueListener для текущего процесса
+    """
+    global _listener
+    records = queue.SimpleQueue()
+    _queue_handler.queue = records
+    _listener = QueueListener(records, _stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def setup_logging(level="INFO"):
+    """
+    Логирование через очередь: обработчики запросов только кладут запись в очередь,
+    а форматирование и запись в поток вывода выполняет отдельный поток QueueListener.
+    Потоки не переживают fork (gunicorn --preload), поэтому в дочернем процессе
+    поток и очередь создаются заново.
+    """
+    global _queue_handler, _stream_handler
+    if _listener is not None:
+        return _listener
+
+    _stream_handler = logging.StreamHandler()
+    _stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    _queue_handler = QueueHandler(queue.SimpleQueue())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    _start_listener()
+    os.register_at_fork(after_in_child=_start_listener)
+    atexit.register(_stop_listener)
+    return _listener
@@ -1,46 +1,191 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import Request
 from starlette.responses import Response
-from sqlalchemy.orm import Session
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from datetime import datetime
+from typing import List, Optional
+import asyncio
 import os
 import json
 import logging
-from .pdf_generator import create_pdf
-from model.process_image import process_image, setup_model, last_prediction_results
-from .model import Base, User
-from .database import engine, SessionLocal
-from .schemas import UserCreate, UserOut
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+import hashlib
+import time
+import uuid
+import aiofiles
+import numpy as np
+from model.process_image import process_image, model_identity
+from model.decoding import decode_gray
+from .model import User, Image, Report, Defect, InferenceTask
+from .database import engine, async_engine, AsyncSessionLocal
+from .migrations import upgrade
+from .schemas import UserCreate, UserOut, BatchReportRequest
+from .config import (
+    MODEL_PATH, UPLOAD_DIR,
+    BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS,
+    INFERENCE_WORKERS, INFERENCE_POOL_MODE, INFERENCE_QUEUE_SIZE,
+    TORCH_THREADS_PER_WORKER, INFERENCE_RETRY_AFTER,
+    INFERENCE_QUEUE, QUEUE_POLL_INTERVAL, QUEUE_WAIT_TIMEOUT,
+    JOB_STORE_MAX_JOBS, JOB_TTL_SECONDS, JOB_MAX_WAIT, JOB_RETRY_INTERVAL,
+    PREDICTION_CACHE_SIZE, PREDICTION_CACHE_DIR,
+    INFERENCE_BACKEND, EXPORT_DIR, HISTOGRAM_REFERENCE,
+    REPORT_WORKERS, REPORT_BATCH_MAX, BULK_UPLOAD_MAX_FILES, BULK_UPLOAD_CONCURRENCY,
+    USERS_PAGE_SIZE, USERS_MAX_PAGE_SIZE,
+    MODEL_PRELOAD, MODEL_WARMUP_SIZE, MODEL_RETRY_AFTER,
+    PYRAMID_TILE_SIZE, PYRAMID_TILE_OVERLAP, PYRAMID_JPEG_QUALITY, THUMBNAIL_SIZE, PYRAMID_WORKERS,
+    DECODE_SPILL_DIR, LOG_LEVEL, SERVER_TIMING,
+    MEMORY_BUDGET_MB, MEMORY_BUDGET_FRACTION, MEMORY_WAIT_TIMEOUT, WEB_CONCURRENCY,
 )
+from .inference_pool import InferencePool, PoolFullError, build_predictor
+from .jobs import JobStore, JobStoreFullError, JOB_FAILED, FINISHED_STATUSES
+from .task_queue import enqueue_task, wait_for_task, task_stats, task_to_dict
+from .pipeline import pipeline_options, pipeline_identity
+from .model_loader import ModelLoader
+from .prediction_cache import PredictionCache
+from .report_engine import ReportEngine, rects_digest
+from .pyramid import PyramidStore, DZI_NAME, THUMBNAIL_NAME, PYRAMID_READY
+from .file_serving import file_response, etag_matches, IMMUTABLE_CACHE_CONTROL
+from .user_listing import InvalidListingParams, parse_fields, decode_cursor, listing_etag, list_users
+from .logging_setup import setup_logging
+from .bulk_upload import BulkUploadError, is_zip_upload, iter_uploaded_pngs
+from .admission import MemoryBudget, MemoryBudgetExceeded, MemoryWaitTimeout, detect_memory_limit, image_cost
+from .defect_store import SEGMENT_JOINT, defect_rows, replace_defects, query_defects, defect_stats
+from .result_format import result_response, to_jsonable
+from . import metrics
+
+# Настройка логирования: запись в поток вывода выполняется вне обработчиков запросов
+setup_logging(LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
 # Определение путей
-UPLOAD_DIR = "/app/server/images"
 REPORTS_DIR = "/app/server/reports"
+PYRAMIDS_DIR = "/app/server/pyramids"
+
+# Ограничения загрузки
+MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
 
 # Создание директорий, если они не существуют
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(REPORTS_DIR, exist_ok=True)
+os.makedirs(PYRAMIDS_DIR, exist_ok=True)
+if DECODE_SPILL_DIR:
+    os.makedirs(DECODE_SPILL_DIR, exist_ok=True)
 
 # Инициализация модели
-try:
-    model_path = "/app/model/utils/model.pth"
-    predictor = setup_model(model_path)
-    logger.info("Модель успешно инициализирована")
-except Exception as e:
-    logger.error(f"Ошибка при инициализации модели: {e}")
-    raise
+model_path = MODEL_PATH
+
+# Инференс в отдельных воркерах через таблицу inference_tasks: API модель не загружает
+use_task_queue = INFERENCE_QUEUE == "db"
+
+# Режим preload-then-fork (gunicorn --preload): веса загружаются один раз в родительском
+# процессе, воркеры после fork используют их совместно (copy-on-write)
+preloaded_predictor = None
+if MODEL_PRELOAD:
+    import torch
+
+    # CUDA-контекст родительского процесса не переживает fork: воркеры упали бы на первом инференсе.
+    # Остальные бэкенды работают на CPU
+    if INFERENCE_BACKEND == "eager" and torch.cuda.is_available():
+        raise RuntimeError(
+            "MODEL_PRELOAD несовместим с инференсом на GPU: запустите gunicorn без MODEL_PRELOAD "
+            "или выберите бэкенд для CPU (INFERENCE_BACKEND=quantized, torchscript, onnx)"
+        )
+    preloaded_predictor = build_predictor(model_path, 1, 0, INFERENCE_BACKEND, EXPORT_DIR)
+    logger.info("Веса модели загружены до запуска воркеров")
+    if INFERENCE_POOL_MODE == "process":
+        logger.warning("MODEL_PRELOAD несовместим с INFERENCE_POOL_MODE=process, используется пул потоков")
+
+def create_inference_pool():
+    """
+    Создает пул инференса; возвращает пул и предиктор с пакетной обработкой (или None)
+    """
+    if BATCH_MAX_SIZE > 1 or preloaded_predictor is not None:
+        # Одна реплика модели на процесс, общая для потоков пула:
+        # пакетная обработка имеет смысл только с общей репликой, а загруженные до fork веса не копируются
+        predictor = build_predictor(
+            model_path, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, INFERENCE_BACKEND, EXPORT_DIR,
+            predictor=preloaded_predictor,
+        )
+        pool = InferencePool(
+            lambda: predictor,
+            workers=INFERENCE_WORKERS,
+            mode="thread",
+            queue_size=INFERENCE_QUEUE_SIZE,
+            threads_per_worker=TORCH_THREADS_PER_WORKER,
+        )
+        return pool, predictor if BATCH_MAX_SIZE > 1 else None
 
-# Глобальная переменная для хранения последних результатов предсказания
-last_prediction_results = None
+    pool = InferencePool(
+        build_predictor,
+        (model_path, 1, 0, INFERENCE_BACKEND, EXPORT_DIR),
+        workers=INFERENCE_WORKERS,
+        mode=INFERENCE_POOL_MODE,
+        queue_size=INFERENCE_QUEUE_SIZE,
+        threads_per_worker=TORCH_THREADS_PER_WORKER,
+    )
+    return pool, None
+
+def warm_up_inference(pool):
+    """
+    Первый проход модели медленный (выделение памяти, инициализация ядер),
+    поэтому до приема запросов каждый воркер пула обрабатывает пустой снимок.
+    Отсев окон отключен: иначе пустой снимок целиком отсеивается и модель не запускается
+    """
+    futures = [
+        submit_inference(np.zeros((MODEL_WARMUP_SIZE, MODEL_WARMUP_SIZE, 3), dtype=np.uint8), pool, screen=None)
+        for _ in range(pool.workers)
+    ]
+    for future in futures:
+        future.result()
+
+model_loader = ModelLoader(create_inference_pool, warm_up_inference if MODEL_WARMUP_SIZE > 0 else None)
+
+# Параметры конвейера: окна, выравнивание гистограммы по эталону, обрезка до полосы шва
+pipeline = pipeline_options()
+
+# Кэш предсказаний по содержимому изображения
+prediction_cache = None
+if PREDICTION_CACHE_SIZE > 0:
+    prediction_cache = PredictionCache(
+        model_identity(
+            model_path, INFERENCE_BACKEND,
+            histogram_reference=HISTOGRAM_REFERENCE,
+            **pipeline_identity(pipeline),
+        ),
+        max_entries=PREDICTION_CACHE_SIZE,
+        cache_dir=PREDICTION_CACHE_DIR or None,
+    )
+
+# Результаты предсказаний хранятся по задачам
+job_store = JobStore(max_jobs=JOB_STORE_MAX_JOBS, ttl_seconds=JOB_TTL_SECONDS)
+
+# Построение PDF-отчетов в отдельных процессах
+report_engine = ReportEngine(workers=REPORT_WORKERS)
+
+# Пирамиды тайлов и миниатюры для просмотра снимков
+pyramid_store = PyramidStore(
+    PYRAMIDS_DIR,
+    tile_size=PYRAMID_TILE_SIZE,
+    overlap=PYRAMID_TILE_OVERLAP,
+    quality=PYRAMID_JPEG_QUALITY,
+    thumbnail_size=THUMBNAIL_SIZE,
+    workers=PYRAMID_WORKERS,
+)
+
+# Бюджет памяти под декодирование и инференс одновременно обрабатываемых снимков
+memory_budget = MemoryBudget(
+    MEMORY_BUDGET_MB << 20 if MEMORY_BUDGET_MB > 0
+    else detect_memory_limit() * MEMORY_BUDGET_FRACTION / max(WEB_CONCURRENCY, 1)
+)
+
+# Ссылки на фоновые задачи, чтобы их не удалил сборщик мусора
+background_jobs = set()
 
 app = FastAPI()
 
@@ -77,143 +222,924 @@ class CORSMiddlewareStaticFiles(StaticFiles):
         return response
 
 # Монтирование статических файлов с CORS
-app.mount("/images", CORSMiddlewareStaticFiles(directory=UPLOAD_DIR), name="images")
 app.mount("/reports", CORSMiddlewareStaticFiles(directory=REPORTS_DIR), name="reports")
 
-# Создание таблиц в базе
-Base.metadata.create_all(bind=engine)
+# Создание таблиц в базе и перенос файлов пользователей из JSON-столбцов
+upgrade(engine)
+# Соединения, открытые до fork (gunicorn --preload), не должны достаться воркерам
+engine.dispose()
+
+def pool_stats():
+    return model_loader.pool.stats() if model_loader.pool is not None else None
+
+# Метрики пула инференса и кэша, снимаемые в момент сбора
+metrics.gauge_callback(
+    "radex_inference_queue_depth",
+    "Количество запросов в очереди пула инференса",
+    lambda: max(pool_stats()["pending"] - model_loader.pool.workers, 0) if pool_stats() else None,
+)
+metrics.gauge_callback(
+    "radex_inference_pool_pending",
+    "Количество запросов в пуле инференса (в очереди и в работе)",
+    lambda: pool_stats()["pending"] if pool_stats() else None,
+)
+metrics.gauge_callback(
+    "radex_model_ready",
+    "Модель загружена, прогрета и принимает запросы",
+    lambda: 1 if model_loader.ready else 0,
+)
+if prediction_cache is not None:
+    metrics.counter_callback(
+        "radex_prediction_cache_hits_total",
+        "Попадания в кэш предсказаний",
+        lambda: prediction_cache.stats()["memory_hits"] + prediction_cache.stats()["disk_hits"],
+    )
+    metrics.counter_callback(
+        "radex_prediction_cache_misses_total",
+        "Промахи кэша предсказаний",
+        lambda: prediction_cache.stats()["misses"],
+    )
+metrics.gauge_callback(
+    "radex_memory_budget_bytes",
+    "Бюджет памяти под декодирование и инференс снимков",
+    lambda: memory_budget.capacity,
+)
+metrics.gauge_callback(
+    "radex_memory_in_use_bytes",
+    "Зарезервированная снимками в обработке память",
+    lambda: memory_budget.in_use,
+)
+metrics.gauge_callback(
+    "radex_memory_waiting_requests",
+    "Снимки в очереди на память",
+    lambda: memory_budget.stats()["waiting"],
+)
+metrics.counter_callback(
+    "radex_memory_queued_total",
+    "Снимки, ожидавшие освобождения памяти",
+    lambda: memory_budget.queued,
+)
+metrics.counter_callback(
+    "radex_memory_rejected_total",
+    "Снимки, отклоненные как не помещающиеся в бюджет памяти",
+    lambda: memory_budget.rejected,
+)
+metrics.counter_callback(
+    "radex_memory_wait_timeouts_total",
+    "Снимки, не дождавшиеся памяти",
+    lambda: memory_budget.timeouts,
+)
+if BATCH_MAX_SIZE > 1:
+    metrics.gauge_callback(
+        "radex_batch_fill_ratio",
+        "Средняя заполненность пакетов модели",
+        lambda: (
+            model_loader.shared_predictor.stats()["avg_fill_ratio"]
+            if model_loader.shared_predictor is not None else None
+        ),
+    )
 
-def get_db():
-    db = SessionLocal()
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    token = metrics.start_request_timing()
+    start = time.perf_counter()
     try:
-        yield db
+        response = await call_next(request)
+    finally:
+        elapsed = time.perf_counter() - start
+        server_timing = metrics.finish_request_timing(token)
+
+    endpoint = request.scope.get("endpoint")
+    metrics.http_request_duration.labels(
+        method=request.method,
+        endpoint=getattr(endpoint, "__name__", type(endpoint).__name__) if endpoint else "unmatched",
+        status=response.status_code,
+    ).observe(elapsed)
+    if SERVER_TIMING:
+        total = f"total;dur={elapsed * 1000:.1f}"
+        response.headers["Server-Timing"] = f"{server_timing}, {total}" if server_timing else total
+    return response
+
+@app.get("/metrics")
+def get_metrics():
+    # Через заголовок: с media_type Starlette добавил бы к типу второй charset
+    return Response(metrics.render(), headers={"Content-Type": metrics.PROMETHEUS_CONTENT_TYPE})
+
+@app.get("/health")
+def health():
+    """
+    Liveness: процесс жив и отвечает, независимо от состояния модели
+    """
+    return {"status": "ok"}
+
+def inference_ready():
+    """
+    Можно ли принимать снимки: модель загружена или инференс выполняют воркеры очереди
+    """
+    return use_task_queue or model_loader.ready
+
+@app.get("/ready")
+def ready():
+    """
+    Readiness: модель загружена и прогрета (с очередью в базе - сразу)
+    """
+    if use_task_queue:
+        return {"status": "ready", "queue": INFERENCE_QUEUE}
+    state = model_loader.stats()
+    if not model_loader.ready:
+        return JSONResponse(status_code=503, content=state, headers={"Retry-After": str(MODEL_RETRY_AFTER)})
+    return state
+
+def image_path(filename):
+    """
+    Путь к загруженному снимку; имена с компонентами пути отклоняются
+    """
+    if os.path.basename(filename) != filename or not os.path.isfile(os.path.join(UPLOAD_DIR, filename)):
+        raise HTTPException(status_code=404, detail="Изображение не найдено")
+    return os.path.join(UPLOAD_DIR, filename)
+
+@app.api_route("/images/{filename}", methods=["GET", "HEAD"])
+def get_image(filename: str, request: Request):
+    """
+    Оригинал снимка с поддержкой Range. Файл может быть перезаписан через /replace-image,
+    поэтому клиент перепроверяет его по ETag
+    """
+    return file_response(
+        request, image_path(filename), media_type="image/png",
+        headers={"Access-Control-Allow-Origin": "*"},
+    )
+
+@app.get("/images/{filename}/pyramid")
+def get_image_pyramid(filename: str):
+    """
+    Состояние пирамиды тайлов снимка и ссылки на версию Deep Zoom и миниатюру
+    """
+    image_path(filename)
+    state = pyramid_store.state(filename)
+    if state["status"] == PYRAMID_READY:
+        base = f"/images/{filename}/pyramid/{state['version']}"
+        state = {**state, "dzi": f"{base}/{DZI_NAME}", "thumbnail": f"{base}/{THUMBNAIL_NAME}"}
+    return JSONResponse(content=state, headers={"Cache-Control": "no-cache"})
+
+@app.api_route("/images/{filename}/pyramid/{version}/{path:path}", methods=["GET", "HEAD"])
+def get_image_pyramid_file(filename: str, version: str, path: str, request: Request):
+    """
+    Файл версии пирамиды (DZI, тайл или миниатюра). Версия - хэш содержимого снимка,
+    поэтому файлы неизменяемы и кэшируются без перепроверки
+    """
+    root = os.path.realpath(PYRAMIDS_DIR)
+    full_path = os.path.realpath(
+        os.path.join(root, PyramidStore.name_for(filename), os.path.basename(version), path)
+    )
+    if not full_path.startswith(root + os.sep) or not os.path.isfile(full_path):
+        raise HTTPException(status_code=404, detail="Файл пирамиды не найден")
+
+    media_type = "application/xml" if path == DZI_NAME else None
+    return file_response(
+        request, full_path, media_type=media_type, cache_control=IMMUTABLE_CACHE_CONTROL,
+        headers={"Access-Control-Allow-Origin": "*"},
+    )
+
+@app.on_event("startup")
+def start_model_loading():
+    if not use_task_queue:
+        model_loader.start()
+
+@app.on_event("shutdown")
+async def shutdown_inference_pool():
+    model_loader.shutdown(wait=False)
+    pyramid_store.shutdown(wait=False)
+    report_engine.shutdown(wait=False)
+    await async_engine.dispose()
+
+def pool_full_error():
+    return HTTPException(
+        status_code=503,
+        detail="Сервер перегружен, повторите запрос позже",
+        headers={"Retry-After": str(INFERENCE_RETRY_AFTER)},
+    )
+
+class QueueWaitTimeout(Exception):
+    """
+    Воркеры очереди не успели обработать снимок за QUEUE_WAIT_TIMEOUT
+    """
+
+def model_not_ready_error():
+    return HTTPException(
+        status_code=503,
+        detail="Модель загружается, повторите запрос позже",
+        headers={"Retry-After": str(MODEL_RETRY_AFTER)},
+    )
+
+def memory_cost(data):
+    """
+    Оценка памяти под декодирование и инференс снимка по заголовку PNG
+    """
+    return image_cost(data, pipeline["tile_size"], pipeline["tile_batch_size"]) or 0
+
+def check_memory_budget(data):
+    """
+    Ранний отказ до обработки снимка: не PNG или снимок больше всего бюджета памяти узла
+    (с очередью в базе снимки декодируют воркеры, и бюджет узла API не проверяется)
+    """
+    cost = image_cost(data, pipeline["tile_size"], pipeline["tile_batch_size"])
+    if cost is None:
+        raise HTTPException(status_code=400, detail="Файл не является PNG изображением")
+    if use_task_queue:
+        return
+    try:
+        memory_budget.check(cost)
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+def memory_busy_error():
+    return HTTPException(
+        status_code=503,
+        detail="Недостаточно памяти для обработки снимка, повторите позже",
+        headers={"Retry-After": str(INFERENCE_RETRY_AFTER)},
+    )
+
+def upload_filename(full_name):
+    """
+    Имя файла загруженного снимка: время загрузки и случайный суффикс, чтобы одновременные
+    загрузки одного пользователя (обычные и пакетные) не перезаписывали файлы друг друга
+    """
+    return f"{full_name}_{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{uuid.uuid4().hex[:8]}.png"
+
+def submit_inference(img, pool=None, **overrides):
+    return (pool or model_loader.pool).submit(process_image, img, None, as_arrays=True, **{**pipeline, **overrides})
+
+async def save_upload(file, file_path):
+    """
+    Потоковое чтение загрузки за один проход.
+    Проверяет ограничение размера, считает SHA-256 и асинхронно пишет файл на диск.
+    Возвращает содержимое файла и его хэш.
+    """
+    hasher = hashlib.sha256()
+    data = bytearray()
+    read_time = write_time = 0.0
+
+    try:
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while True:
+                start = time.perf_counter()
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                read_time += time.perf_counter() - start
+                if not chunk:
+                    break
+                if len(data) + len(chunk) > MAX_FILE_SIZE:
+                    raise HTTPException(status_code=400, detail="Размер файла превышает 100MB")
+                hasher.update(chunk)
+                data += chunk
+
+                start = time.perf_counter()
+                await buffer.write(chunk)
+                write_time += time.perf_counter() - start
     finally:
-        db.close()
+        metrics.record_stage("upload_read", read_time)
+        metrics.record_stage("disk_write", write_time)
+
+    return data, hasher.hexdigest()
+
+def schedule_pyramid(filename, data, file_hash):
+    """
+    Построение пирамиды тайлов и миниатюры в фоне
+    """
+    def log_failure(future):
+        if future.exception() is not None:
+            logger.error(f"Ошибка при построении пирамиды {filename}: {future.exception()}")
+
+    pyramid_store.submit(filename, bytes(data), file_hash).add_done_callback(log_failure)
+
+async def predict(data, file_hash, job, wait_for_slot=False):
+    """
+    Поиск дефектов на загруженном снимке.
+    Сначала проверяется кэш предсказаний: по хэшу файла (без декодирования),
+    затем по хэшу декодированного изображения. При промахе снимок
+    декодируется из памяти в одноканальный массив и отправляется в пул инференса.
+    С wait_for_slot=True при заполненной очереди пула запрос ждет освобождения места,
+    а память под снимок ждет без ограничения по времени (иначе - до MEMORY_WAIT_TIMEOUT).
+    """
+    cache_keys = []
+    if prediction_cache is not None:
+        file_key = prediction_cache.key_for_file(file_hash)
+        cached = await asyncio.to_thread(prediction_cache.get, file_key, False)
+        if cached is not None:
+            logger.info(f"Результат взят из кэша: {job.filename}")
+            return cached
+        cache_keys.append(file_key)
+
+    if use_task_queue:
+        result = await predict_in_queue(job, wait_for_slot)
+        if prediction_cache is not None:
+            await asyncio.to_thread(prediction_cache.put, file_key, result)
+        return result
+
+    # Декодирование и инференс - только когда в бюджете памяти есть место под снимок
+    async with memory_budget.reserve(memory_cost(data), None if wait_for_slot else MEMORY_WAIT_TIMEOUT):
+        with metrics.stage("decode"):
+            img = await asyncio.to_thread(decode_gray, data, DECODE_SPILL_DIR or None)
+        if img is None:
+            raise ValueError(f"Не удалось декодировать изображение: {job.filename}")
+        metrics.image_pixels.observe(img.shape[0] * img.shape[1])
+
+        if prediction_cache is not None:
+            image_key = await asyncio.to_thread(prediction_cache.key_for, img)
+            cached = await asyncio.to_thread(prediction_cache.get, image_key)
+            if cached is not None:
+                logger.info(f"Результат взят из кэша: {job.filename}")
+                await asyncio.to_thread(prediction_cache.put, file_key, cached)
+                return cached
+            cache_keys.append(image_key)
+
+        with metrics.inferences_in_flight.track_inprogress():
+            with metrics.stage("inference"):
+                while True:
+                    try:
+                        future = submit_inference(img)
+                        break
+                    except PoolFullError:
+                        if not wait_for_slot:
+                            raise
+                        await asyncio.sleep(JOB_RETRY_INTERVAL)
+
+                job_store.start(job)
+                result = await asyncio.wrap_future(future)
+        # Снимок освобождается до возврата памяти в бюджет
+        del img
+
+    roi = result.get("roi") if result else None
+    if roi is not None:
+        metrics.roi_results.labels(result="applied" if roi["applied"] else "fallback").inc()
+        metrics.roi_skipped_fraction.observe(roi["skipped_fraction"])
+    triage = result.get("triage") if result else None
+    if triage is not None:
+        metrics.triage_tiles.labels(result="kept").inc(triage["tiles"] - triage["skipped"])
+        metrics.triage_tiles.labels(result="skipped").inc(triage["skipped"])
+
+    for key in cache_keys:
+        await asyncio.to_thread(prediction_cache.put, key, result)
+    return result
+
+async def save_defects(image_id, result):
+    """
+    Сохранение найденных дефектов снимка в отдельной сессии (для фоновых задач)
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            await replace_defects(db, image_id, result)
+            with metrics.stage("db_commit"):
+                await db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении дефектов снимка {image_id}: {e}")
+
+async def predict_in_queue(job, wait_for_slot=False):
+    """
+    Инференс через очередь в базе: задача с id задачи API ставится в inference_tasks
+    (повторно - не дублируется), результат ждется опросом таблицы.
+    Без wait_for_slot ожидание ограничено QUEUE_WAIT_TIMEOUT.
+    """
+    async with AsyncSessionLocal() as db:
+        await enqueue_task(db, job.id, job.user_id, job.filename)
+        await db.commit()
+
+    with metrics.stage("inference"):
+        task = await wait_for_task(
+            AsyncSessionLocal, job.id,
+            timeout=None if wait_for_slot else QUEUE_WAIT_TIMEOUT,
+            interval=QUEUE_POLL_INTERVAL,
+            on_running=lambda: job_store.start(job),
+        )
+    if task is None:
+        raise RuntimeError(f"Задача {job.id} удалена из очереди")
+    if task.status == JOB_FAILED:
+        raise RuntimeError(task.error or "Ошибка инференса")
+    if task.status not in FINISHED_STATUSES:
+        raise QueueWaitTimeout()
+    return task.result
+
+async def run_job(job, data, file_hash, image_id):
+    """
+    Фоновое выполнение задачи инференса.
+    Пока очередь пула заполнена, задача ждет своей очереди.
+    """
+    try:
+        result = await predict(data, file_hash, job, wait_for_slot=True)
+    except Exception as e:
+        logger.error(f"Ошибка при обработке изображения {job.filename}: {e}")
+        job_store.fail(job, str(e))
+        return
+
+    await save_defects(image_id, result)
+    job_store.finish(job, result)
+    logger.info(f"Задача {job.id} завершена: {job.filename}")
+
+def start_job(job, data, file_hash, image_id):
+    task = asyncio.create_task(run_job(job, data, file_hash, image_id))
+    background_jobs.add(task)
+    task.add_done_callback(background_jobs.discard)
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def find_user_image(db, user_id, filename):
+    """
+    Снимок пользователя по имени файла (None, если файл не принадлежит пользователю)
+    """
+    return await db.scalar(select(Image).where(Image.user_id == user_id, Image.filename == filename))
+
+async def discard_upload(db, image, file_path, job=None):
+    """
+    Откат принятой загрузки, когда запрос отклоняется с 503: клиент повторит его
+    по Retry-After, и снимок не должен остаться в списке пользователя дважды
+    """
+    if job is not None:
+        job_store.discard(job)
+    await db.delete(image)
+    await db.commit()
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+async def get_or_add_report(db, user_id, filename, image_id=None):
+    """
+    Запись об отчете; повторное построение того же отчета новой записи не создает
+    """
+    report = await db.scalar(select(Report).where(Report.filename == filename))
+    if report is None:
+        report = Report(user_id=user_id, image_id=image_id, filename=filename)
+        db.add(report)
+    return report
 
-@app.get("/users/", response_model=list[UserOut])
-def get_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
-    return users
+async def user_files(db, user_id):
+    """
+    Имена снимков и отчетов пользователя в порядке добавления
+    """
+    images = await db.execute(select(Image.filename).where(Image.user_id == user_id).order_by(Image.id))
+    reports = await db.execute(select(Report.filename).where(Report.user_id == user_id).order_by(Report.id))
+    return {"images": images.scalars().all(), "reports": reports.scalars().all()}
+
+@app.get("/users/")
+async def get_users(
+        request: Request,
+        limit: int = Query(USERS_PAGE_SIZE, ge=1, le=USERS_MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
+        db: AsyncSession = Depends(get_db),
+):
+    """
+    Постраничный список пользователей: курсор следующей страницы - в заголовке X-Next-Cursor,
+    fields - выбор полей (например, без images и reports), If-None-Match - ответ 304
+    """
+    try:
+        selected = parse_fields(fields)
+        after_id = decode_cursor(cursor)
+    except InvalidListingParams as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    etag = await listing_etag(db, selected, after_id, limit)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    users, next_cursor = await list_users(db, selected, after_id, limit)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        next_url = request.url.include_query_params(cursor=next_cursor)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return JSONResponse(content=users, headers=headers)
 
 @app.post("/users/", response_model=UserOut)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     new_user = User(
         fullName=user.fullName,
         status=user.status,
         email=user.email,
         password=user.password,
-        images=user.images,
-        reports=user.reports,
+        images=[Image(filename=filename) for filename in user.images or []],
+        reports=[Report(filename=filename) for filename in user.reports or []],
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
     return new_user
 
 @app.delete("/users/{user_id}", response_model=UserOut)
-def delete_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(
+        select(User).where(User.id == user_id).options(selectinload(User.images), selectinload(User.reports))
+    )
     if user is None:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
     try:
-        if user.images:
-            for filename in user.images:
-                file_path = os.path.join(UPLOAD_DIR, filename)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.info(f"Удален файл изображения: {file_path}")
+        for image in user.images:
+            file_path = os.path.join(UPLOAD_DIR, image.filename)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                logger.info(f"Удален файл изображения: {file_path}")
 
-        if user.reports:
-            for filename in user.reports:
-                file_path = os.path.join(REPORTS_DIR, filename)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.info(f"Удален файл отчета: {file_path}")
+        for image in user.images:
+            pyramid_store.delete(image.filename)
+
+        for report in user.reports:
+            file_path = os.path.join(REPORTS_DIR, report.filename)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                logger.info(f"Удален файл отчета: {file_path}")
 
-        db.delete(user)
-        db.commit()
-        return user
+        # Ответ собирается до удаления: после commit связанные записи уже недоступны
+        deleted = UserOut.from_orm(user)
+        await db.delete(user)
+        await db.commit()
+        return deleted
     except Exception as e:
         logger.error(f"Ошибка при удалении пользователя: {e}")
         raise HTTPException(status_code=500, detail="Ошибка при удалении пользователя")
 
 @app.post("/upload")
 async def upload_image(
+        request: Request,
         file: UploadFile = File(...),
         userId: int = Form(...),
-        db: Session = Depends(get_db)
+        async_job: bool = Query(False, alias="async"),
+        db: AsyncSession = Depends(get_db)
 ):
     # Проверка типа файла
     if file.content_type != "image/png":
         raise HTTPException(status_code=400, detail="Разрешены только PNG изображения")
 
-    # Проверка размера файла (максимум 100MB)
-    MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
-    file_size = 0
-    chunk_size = 1024 * 1024  # 1MB
+    # Быстрый отказ, если очередь инференса заполнена
+    if not inference_ready():
+        raise model_not_ready_error()
+    if not async_job and not use_task_queue and model_loader.pool.is_full():
+        raise pool_full_error()
 
-    while chunk := await file.read(chunk_size):
-        file_size += len(chunk)
-        if file_size > MAX_FILE_SIZE:
-            raise HTTPException(status_code=400, detail="Размер файла превышает 100MB")
-
-    # Сброс позиции файла для повторного чтения
-    await file.seek(0)
-
-    user = db.query(User).filter(User.id == userId).first()
+    user = await db.get(User, userId)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
-    filename = f"{user.fullName}_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.png"
+    filename = upload_filename(user.fullName)
     file_path = os.path.join(UPLOAD_DIR, filename)
+    job = None
 
     try:
-        # Сохранение файла
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
+        # Один проход по загрузке: проверка размера, хэш, запись на диск и буфер для декодирования
+        data, file_hash = await save_upload(file, file_path)
+        check_memory_budget(data)
+
+        try:
+            job = job_store.create(user.id, filename)
+        except JobStoreFullError:
+            raise pool_full_error()
+
+        # Запись о снимке - вставка одной строки
+        image = Image(user_id=user.id, filename=filename, content_hash=file_hash)
+        db.add(image)
+        with metrics.stage("db_commit"):
+            await db.commit()
+
+        # Асинхронный режим: сразу возвращаем идентификатор задачи.
+        # Пирамида строится только для принятых снимков: отклоненные с 503 удаляются
+        def accepted():
+            schedule_pyramid(filename, data, file_hash)
+            return JSONResponse(status_code=202, content={
+                "jobId": job.id,
+                "filename": filename,
+                "status": job.status,
+            })
+
+        if async_job:
+            start_job(job, data, file_hash, image.id)
+            return accepted()
 
         # Обработка изображения для поиска дефектов
-        global last_prediction_results
         try:
-            last_prediction_results = process_image(predictor, file_path, None)
-            logger.info(f"Изображение успешно обработано: {filename}")
-            logger.info(f"Результаты анализа: {json.dumps(last_prediction_results, indent=2)}")
+            result = await predict(data, file_hash, job)
+            await save_defects(image.id, result)
+            job_store.finish(job, result)
+            logger.info(
+                "Изображение успешно обработано: %s, дефектов: %d",
+                filename, result["instances"]["num_instances"],
+            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Результаты анализа: %s", json.dumps(to_jsonable(result)))
+        except PoolFullError:
+            await discard_upload(db, image, file_path, job)
+            raise pool_full_error()
+        except MemoryWaitTimeout:
+            await discard_upload(db, image, file_path, job)
+            raise memory_busy_error()
+        except QueueWaitTimeout:
+            # Воркеры очереди заняты: задача остается в очереди, результат - через /jobs/{id}
+            start_job(job, data, file_hash, image.id)
+            return accepted()
         except Exception as e:
             logger.error(f"Ошибка при обработке изображения: {e}")
-            last_prediction_results = None
-
-        # Обновление списка изображений пользователя
-        if user.images is None:
-            user.images = []
-        user.images = (user.images or []) + [filename]
-
-        db.commit()
-        db.refresh(user)
+            job_store.fail(job, str(e))
+            result = None
 
+        schedule_pyramid(filename, data, file_hash)
         response_data = {
             "filename": filename,
-            "defects": last_prediction_results
+            "jobId": job.id,
+            "defects": result
         }
-        logger.info(f"Отправляем ответ: {json.dumps(response_data, indent=2)}")
-        return response_data
+        return result_response(request, response_data)
 
+    except HTTPException:
+        if job is None and os.path.exists(file_path):
+            os.remove(file_path)
+        raise
     except Exception as e:
         logger.error(f"Ошибка при загрузке файла: {e}")
+        if job is not None and not job.finished:
+            job_store.fail(job, str(e))
         if os.path.exists(file_path):
             os.remove(file_path)
         raise HTTPException(status_code=500, detail="Ошибка при загрузке файла")
 
+async def process_bulk_file(name, data, filename, user_id, stored):
+    """
+    Сохранение и поиск дефектов для одного снимка пакетной загрузки.
+    Для каждого сохраненного файла в stored записываются хэш содержимого и
+    результат модели (None до завершения обработки) - для записи в базу.
+    """
+    try:
+        check_memory_budget(data)
+    except HTTPException as e:
+        raise BulkUploadError(e.detail)
+
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    file_hash = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+    with metrics.stage("disk_write"):
+        async with aiofiles.open(file_path, "wb") as buffer:
+            await buffer.write(data)
+    stored[filename] = (file_hash, None)
+
+    try:
+        job = job_store.create(user_id, filename)
+    except JobStoreFullError:
+        raise BulkUploadError("Хранилище задач заполнено")
+    schedule_pyramid(filename, data, file_hash)
+
+    try:
+        result = await predict(data, file_hash, job, wait_for_slot=True)
+    except Exception as e:
+        logger.error(f"Ошибка при обработке изображения {filename}: {e}")
+        job_store.fail(job, str(e))
+        return {"filename": name, "storedAs": filename, "jobId": job.id, "defects": None, "error": str(e)}
+
+    stored[filename] = (file_hash, result)
+    job_store.finish(job, result)
+    return {"filename": name, "storedAs": filename, "jobId": job.id, "defects": to_jsonable(result)}
+
+async def bulk_upload_results(files, user_id, full_name):
+    """
+    NDJSON-поток результатов пакетной загрузки в порядке готовности.
+    Файлы распаковываются по одному, одновременно обрабатывается не больше
+    BULK_UPLOAD_CONCURRENCY снимков. Записи о снимках и их дефектах добавляются одной транзакцией
+    после обработки всех файлов; при ошибке или обрыве соединения сохраненные файлы удаляются.
+    """
+    lines = asyncio.Queue()
+    slots = asyncio.Semaphore(BULK_UPLOAD_CONCURRENCY)
+    tasks = set()
+    stored = {}
+
+    async def process(name, data, filename):
+        try:
+            line = await process_bulk_file(name, data, filename, user_id, stored)
+        except Exception as e:
+            line = {"filename": name, "defects": None, "error": str(e)}
+        finally:
+            slots.release()
+        await lines.put(line)
+
+    async def produce():
+        try:
+            async for name, data in iter_uploaded_pngs(files, BULK_UPLOAD_MAX_FILES, MAX_FILE_SIZE, UPLOAD_CHUNK_SIZE):
+                if isinstance(data, Exception):
+                    await lines.put({"filename": name, "defects": None, "error": str(data)})
+                    continue
+                await slots.acquire()
+                filename = upload_filename(full_name)
+                task = asyncio.create_task(process(name, data, filename))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            await lines.put(None)
+
+    producer = asyncio.create_task(produce())
+    committed = False
+    failed = 0
+    try:
+        while True:
+            line = await lines.get()
+            if line is None:
+                break
+            failed += "error" in line
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+
+        try:
+            await producer
+            async with AsyncSessionLocal() as db:
+                images = [
+                    Image(user_id=user_id, filename=filename, content_hash=file_hash)
+                    for filename, (file_hash, _) in stored.items()
+                ]
+                db.add_all(images)
+                await db.flush()
+                rows = [row for image in images for row in defect_rows(image.id, stored[image.filename][1])]
+                if rows:
+                    await db.execute(insert(Defect), rows)
+                with metrics.stage("db_commit"):
+                    await db.commit()
+            committed = True
+        except Exception as e:
+            logger.error(f"Ошибка при пакетной загрузке: {e}")
+            yield json.dumps({"done": True, "stored": 0, "error": str(e)}, ensure_ascii=False) + "\n"
+            return
+
+        logger.info(f"Пакетная загрузка завершена: сохранено {len(stored)}, с ошибками {failed}")
+        yield json.dumps({"done": True, "stored": len(stored), "failed": failed}) + "\n"
+    finally:
+        if not committed:
+            producer.cancel()
+            for task in list(tasks):
+                task.cancel()
+            for filename in stored:
+                file_path = os.path.join(UPLOAD_DIR, filename)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                pyramid_store.delete(filename)
+
+@app.post("/upload/bulk")
+async def upload_bulk(
+        files: List[UploadFile] = File(...),
+        userId: int = Form(...),
+        db: AsyncSession = Depends(get_db),
+):
+    """
+    Пакетная загрузка PNG-снимков или ZIP-архивов с ними для одного пользователя.
+    Результат каждого снимка {"filename", "defects"} отдается строкой NDJSON по мере готовности,
+    последняя строка - итог {"done": true, ...} после записи снимков в базу.
+    """
+    for file in files:
+        if not is_zip_upload(file) and file.content_type != "image/png":
+            raise HTTPException(status_code=400, detail="Разрешены только PNG изображения и ZIP-архивы")
+
+    if not inference_ready():
+        raise model_not_ready_error()
+
+    user = await db.get(User, userId)
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    return StreamingResponse(
+        bulk_upload_results(files, user.id, user.fullName),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/defects")
-def get_example_defects():
-    global last_prediction_results
-    if last_prediction_results is None:
+def get_example_defects(request: Request, jobId: Optional[str] = None, userId: Optional[int] = None):
+    if jobId is not None:
+        job = job_store.get(jobId)
+        if job is None or (userId is not None and job.user_id != userId):
+            raise HTTPException(status_code=404, detail="Задача не найдена")
+        results = job.result
+    elif userId is not None:
+        # Без jobId - последний результат того же пользователя, а не любого
+        results = job_store.latest_result(userId)
+    else:
+        raise HTTPException(status_code=400, detail="Укажите jobId или userId")
+
+    if results is None:
         raise HTTPException(status_code=404, detail="Нет доступных результатов предсказания")
     
-    return {
+    return result_response(request, {
         "user": {
-            "defects": last_prediction_results
+            "defects": results
         }
+    })
+
+def defect_filters(
+        userId: Optional[int] = None,
+        imageId: Optional[int] = None,
+        filename: Optional[str] = None,
+        classId: Optional[List[int]] = Query(None),
+        minScore: float = Query(0, ge=0, le=1),
+        segment: Optional[int] = Query(None, ge=0, le=SEGMENT_JOINT),
+):
+    """
+    Фильтры сохраненных дефектов: пользователь, снимок, классы (classId можно повторять),
+    минимальная уверенность и участок мерного пояса (0-9, 10 - стык)
+    """
+    return {
+        "user_id": userId,
+        "image_id": imageId,
+        "filename": filename,
+        "class_ids": classId,
+        "min_score": minScore,
+        "segment": segment,
+    }
+
+@app.get("/defects/query")
+async def get_stored_defects(
+        limit: int = Query(USERS_PAGE_SIZE, ge=1, le=USERS_MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        filters: dict = Depends(defect_filters),
+        db: AsyncSession = Depends(get_db),
+):
+    """
+    Сохраненные дефекты по фильтрам без повторного инференса (keyset-пагинация по курсору)
+    """
+    try:
+        after_id = decode_cursor(cursor)
+    except InvalidListingParams as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    defects, next_cursor = await query_defects(db, after_id, limit, **filters)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return JSONResponse(content={"defects": defects, "nextCursor": next_cursor}, headers=headers)
+
+@app.get("/defects/stats")
+async def get_defect_stats(filters: dict = Depends(defect_filters), db: AsyncSession = Depends(get_db)):
+    """
+    Количество сохраненных дефектов по участкам мерного пояса и классам
+    """
+    return await defect_stats(db, **filters)
+
+@app.get("/jobs/{job_id}")
+async def get_job(request: Request, job_id: str, wait: float = Query(0, ge=0, le=JOB_MAX_WAIT)):
+    job = job_store.get(job_id)
+    if job is None and use_task_queue:
+        # Задача другого узла API: состояние берется из очереди в базе
+        task = await wait_for_task(AsyncSessionLocal, job_id, timeout=wait, interval=QUEUE_POLL_INTERVAL)
+        if task is not None:
+            return result_response(request, task_to_dict(task))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+
+    # Long-poll: ждем завершения задачи не дольше wait секунд
+    if wait and not job.finished:
+        await job_store.wait(job, wait)
+
+    return result_response(request, job.to_dict())
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str):
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(to_jsonable(data))}\n\n"
+
+    job = job_store.get(job_id)
+    if job is None and use_task_queue:
+        async with AsyncSessionLocal() as db:
+            task = await db.get(InferenceTask, job_id)
+        if task is not None:
+            async def stream_task():
+                current = task
+                yield sse("status", {"jobId": current.id, "status": current.status})
+                while current is not None and current.status not in FINISHED_STATUSES:
+                    current = await wait_for_task(AsyncSessionLocal, job_id, timeout=15, interval=QUEUE_POLL_INTERVAL)
+                    if current is not None and current.status not in FINISHED_STATUSES:
+                        yield ": keep-alive\n\n"
+                if current is not None:
+                    yield sse(current.status, task_to_dict(current))
+
+            return StreamingResponse(
+                stream_task(),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+
+    async def stream():
+        yield sse("status", {"jobId": job.id, "status": job.status})
+        while not job.finished:
+            await job_store.wait(job, 15)
+            if not job.finished:
+                yield ": keep-alive\n\n"
+        yield sse(job.status, job.to_dict())
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/inference/stats")
+async def get_inference_stats(db: AsyncSession = Depends(get_db)):
+    return {
+        "queue": await task_stats(db) if use_task_queue else None,
+        "memory": memory_budget.stats(),
+        "model": model_loader.stats(),
+        "pool": pool_stats(),
+        "jobs": job_store.stats(),
+        "cache": prediction_cache.stats() if prediction_cache is not None else None,
+        "batching": model_loader.shared_predictor.stats() if model_loader.shared_predictor is not None else None,
+        "reports": report_engine.stats(),
     }
 
 @app.post("/replace-image")
@@ -222,16 +1148,17 @@ async def replace_image(
     userId: int = Form(...),
     filename: str = Form(...),
     rects: str = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     if file.content_type != "image/png":
         raise HTTPException(status_code=400, detail="Разрешены только PNG изображения")
 
-    user = db.query(User).filter(User.id == userId).first()
+    user = await db.get(User, userId)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
-    if not user.images or filename not in user.images:
+    image = await find_user_image(db, user.id, filename)
+    if image is None:
         raise HTTPException(status_code=400, detail="Файл не принадлежит пользователю")
 
     file_path = os.path.join(UPLOAD_DIR, filename)
@@ -240,37 +1167,103 @@ async def replace_image(
         raise HTTPException(status_code=404, detail="Файл для замены не найден")
 
     try:
-        # Перезапись файла
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
-        logger.info(f"Файл успешно заменен: {filename}")
+        # Перезапись файла и пирамиды - только если содержимое снимка изменилось
+        data = await file.read()
+        image_hash = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+        if image.content_hash != image_hash:
+            with metrics.stage("disk_write"):
+                async with aiofiles.open(file_path, "wb") as buffer:
+                    await buffer.write(data)
+            image.content_hash = image_hash
+            logger.info(f"Файл успешно заменен: {filename}")
+            schedule_pyramid(filename, data, image_hash)
+        else:
+            logger.info(f"Снимок не изменился, перезапись пропущена: {filename}")
 
         # Обработка прямоугольников и создание PDF
         try:
             rect_data = json.loads(rects)
             base_filename = filename.replace('.png', '')
-            create_pdf(base_filename, REPORTS_DIR, rect_data)
-            
-            pdf_filename = f"{base_filename}.pdf"
-            if user.reports is None:
-                user.reports = []
-            user.reports = (user.reports or []) + [pdf_filename]
+            report = await get_or_add_report(db, user.id, f"{base_filename}.pdf", image.id)
+
+            # PDF перестраивается, только если разметка изменилась с прошлого построения
+            digest = rects_digest(rect_data)
+            if report.rects_hash != digest or not os.path.exists(os.path.join(REPORTS_DIR, report.filename)):
+                with metrics.stage("pdf_build"):
+                    await report_engine.render(base_filename, REPORTS_DIR, rect_data)
+                report.rects_hash = digest
+                logger.info(f"PDF отчет создан: {report.filename}")
+            else:
+                logger.info(f"Разметка не изменилась, PDF отчет не перестраивается: {report.filename}")
 
-            db.commit()
-            db.refresh(user)
-            logger.info(f"PDF отчет создан: {pdf_filename}")
+            with metrics.stage("db_commit"):
+                await db.commit()
 
         except Exception as e:
             logger.error(f"Ошибка при создании PDF отчета: {e}")
             raise HTTPException(status_code=500, detail=f"Ошибка создания PDF отчета: {str(e)}")
 
         return {
-            "user": {
-                "images": user.images,
-                "reports": user.reports
-            }
+            "user": await user_files(db, user.id)
         }
 
     except Exception as e:
         logger.error(f"Ошибка при замене файла: {e}")
-        raise HTTPException(status_code=500, detail=f"Ошибка при замене файла: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Ошибка при замене файла: {str(e)}")
+
+@app.post("/render-reports")
+async def create_reports_batch(request: BatchReportRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Параллельное построение нескольких PDF-отчетов по снимкам пользователя
+    """
+    if not request.reports:
+        raise HTTPException(status_code=400, detail="Список отчетов пуст")
+    if len(request.reports) > REPORT_BATCH_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много отчетов в одном запросе (максимум {REPORT_BATCH_MAX})",
+        )
+
+    user = await db.get(User, request.userId)
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    filenames = {report.filename for report in request.reports}
+    images = dict((await db.execute(
+        select(Image.filename, Image.id).where(Image.user_id == user.id, Image.filename.in_(filenames))
+    )).all())
+    foreign = [report.filename for report in request.reports if report.filename not in images]
+    if foreign:
+        raise HTTPException(status_code=400, detail=f"Файлы не принадлежат пользователю: {', '.join(foreign)}")
+
+    jobs = [(report.filename.replace('.png', ''), report.rects) for report in request.reports]
+    with metrics.stage("pdf_build"):
+        rendered = await report_engine.render_many(REPORTS_DIR, jobs)
+
+    results = []
+    created = {}
+    for report, outcome in zip(request.reports, rendered):
+        if isinstance(outcome, Exception):
+            logger.error(f"Ошибка при создании PDF отчета {report.filename}: {outcome}")
+            results.append({"filename": report.filename, "report": None, "error": str(outcome)})
+        else:
+            results.append({"filename": report.filename, "report": outcome, "error": None})
+            created[outcome] = (images[report.filename], rects_digest(report.rects))
+
+    if created:
+        # Хэш разметки сохраняется, чтобы /replace-image не перестраивал те же отчеты
+        existing = {report.filename: report for report in (await db.execute(
+            select(Report).where(Report.filename.in_(created))
+        )).scalars()}
+        for name, (image_id, digest) in created.items():
+            if name in existing:
+                existing[name].rects_hash = digest
+            else:
+                db.add(Report(user_id=user.id, image_id=image_id, filename=name, rects_hash=digest))
+        with metrics.stage("db_commit"):
+            await db.commit()
+
+    return {
+        "reports": results,
+        "user": await user_files(db, user.id)
+    }
@@ -0,0 +1,141 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+    disable_created_metrics, generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+PROMETHEUS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+PIXEL_BUCKETS = (1e5, 1e6, 5e6, 1e7, 2e7, 5e7, 1e8, 2e8)
+FRACTION_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95)
+
+# Ряды *_created удваивают число рядов счетчиков и гистограмм и не используются
+disable_created_metrics()
+
+# Замеры этапов текущего запроса для заголовка Server-Timing
+_request_timings = ContextVar("request_timings", default=None)
+
+# Собственный реестр вместо глобального REGISTRY: в /metrics попадают только метрики сервера
+registry = CollectorRegistry()
+
+
+class _CallbackCollector:
+    """
+    Метрика без меток, значение которой вычисляется callback при каждом сборе (None - нет значения)
+    """
+
+    def __init__(self, family, name, documentation, callback):
+        self.family = family
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def collect(self):
+        metric = self.family(self.name, self.documentation)
+        value = self.callback()
+        if value is not None:
+            metric.add_metric([], value)
+        yield metric
+
+
+def gauge_callback(name, documentation, callback):
+    """
+    Регистрирует gauge, снимаемый в момент сбора метрик
+    """
+    registry.register(_CallbackCollector(GaugeMetricFamily, name, documentation, callback))
+
+
+def counter_callback(name, documentation, callback):
+    """
+    Регистрирует counter, значение которого ведет другой объект (например, кэш или бюджет памяти)
+    """
+    registry.register(_CallbackCollector(CounterMetricFamily, name, documentation, callback))
+
+
+def render():
+    return generate_latest(registry)
+
+
+stage_duration = Histogram(
+    "radex_stage_duration_seconds",
+    "Длительность этапов обработки запроса",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+    registry=registry,
+)
+http_request_duration = Histogram(
+    "radex_http_request_duration_seconds",
+    "Длительность HTTP-запросов",
+    ["method", "endpoint", "status"],
+    buckets=LATENCY_BUCKETS,
+    registry=registry,
+)
+image_pixels = Histogram(
+    "radex_image_pixels",
+    "Количество пикселей загруженных снимков",
+    buckets=PIXEL_BUCKETS,
+    registry=registry,
+)
+roi_skipped_fraction = Histogram(
+    "radex_roi_skipped_fraction",
+    "Доля пикселей снимка вне полосы шва, не поданных в модель",
+    buckets=FRACTION_BUCKETS,
+    registry=registry,
+)
+roi_results = Counter(
+    "radex_roi_total",
+    "Результаты поиска полосы шва: applied - обрезка, fallback - весь снимок",
+    ["result"],
+    registry=registry,
+)
+triage_tiles = Counter(
+    "radex_triage_tiles_total",
+    "Окна снимков после отсева: kept - поданы в модель, skipped - пропущены",
+    ["result"],
+    registry=registry,
+)
+inferences_in_flight = Gauge(
+    "radex_inferences_in_flight",
+    "Количество выполняющихся и ожидающих инференсов",
+    registry=registry,
+)
+
+
+@contextmanager
+def stage(name):
+    """
+    Замер этапа: наблюдение в гистограмме и запись в Server-Timing текущего запроса
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def record_stage(name, seconds):
+    stage_duration.labels(stage=name).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+def start_request_timing():
+    """
+    Начинает сбор замеров этапов для текущего запроса, возвращает токен для сброса
+    """
+    return _request_timings.set([])
+
+
+def finish_request_timing(token):
+    """
+    Завершает сбор замеров и возвращает значение заголовка Server-Timing
+    """
+    timings = _request_timings.get() or []
+    _request_timings.reset(token)
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings)
@@ -0,0 +1,153 @@
+"""
+Перенос списков файлов из JSON-столбцов users.images / users.reports
+в отдельные таблицы images и reports.
+
+Выполняется при старте сервера после создания таблиц; можно запустить и вручную:
+    python -m server.migrations
+Старые столбцы при этом не меняются. Удаление - отдельный необратимый шаг,
+после проверки перенесенных данных:
+    python -m server.migrations --drop-legacy
+"""
+import argparse
+import logging
+import re
+from datetime import datetime
+
+from sqlalchemy import Integer, column, inspect, select, table, text
+from sqlalchemy.types import JSON
+
+from .model import Base, Image, Report
+
+logger = logging.getLogger(__name__)
+
+LEGACY_COLUMNS = ("images", "reports")
+
+# Столбцы, добавленные в уже существующие таблицы (create_all их не создает)
+ADDED_COLUMNS = {
+    "users": {"updated_at": "TIMESTAMP"},
+    "images": {"content_hash": "VARCHAR(64)", "updated_at": "TIMESTAMP"},
+    "reports": {"rects_hash": "VARCHAR(64)", "updated_at": "TIMESTAMP"},
+}
+
+# Имя загруженного снимка: "<ФИО>_<%Y%m%d%H%M%S%f>.png", в новых - со случайным суффиксом "_<8 hex>"
+_TIMESTAMP_RE = re.compile(r"_(\d{20})(?:_[0-9a-f]{8})?\.(?:png|pdf)$")
+
+
+def _created_at(filename, default):
+    match = _TIMESTAMP_RE.search(filename)
+    if match:
+        try:
+            return datetime.strptime(match.group(1), "%Y%m%d%H%M%S%f")
+        except ValueError:
+            pass
+    return default
+
+
+def _legacy_columns(connection):
+    columns = {item["name"] for item in inspect(connection).get_columns("users")}
+    return [name for name in LEGACY_COLUMNS if name in columns]
+
+
+def add_missing_columns(connection):
+    """
+    Добавляет в существующие таблицы столбцы из ADDED_COLUMNS. Возвращает список добавленных.
+    """
+    inspector = inspect(connection)
+    added = []
+    for table_name, columns in ADDED_COLUMNS.items():
+        existing = {item["name"] for item in inspector.get_columns(table_name)}
+        for name, column_type in columns.items():
+            if name not in existing:
+                connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {column_type}"))
+                added.append(f"{table_name}.{name}")
+    if added:
+        logger.info(f"Добавлены столбцы: {', '.join(added)}")
+    return added
+
+
+def migrate_user_files(connection, drop_legacy=False):
+    """
+    Копирует имена файлов из JSON-столбцов пользователей в таблицы images и reports;
+    уже перенесенные файлы пропускаются, поэтому повторный запуск ничего не добавляет.
+    Старые столбцы удаляются только с drop_legacy.
+    Возвращает количество перенесенных (изображений, отчетов).
+    """
+    if connection.dialect.name == "postgresql":
+        # Несколько процессов сервера могут стартовать одновременно
+        connection.execute(text("LOCK TABLE users IN ACCESS EXCLUSIVE MODE"))
+
+    legacy = _legacy_columns(connection)
+    if not legacy:
+        return 0, 0
+
+    users = table("users", column("id", Integer), *(column(name, JSON) for name in legacy))
+    now = datetime.utcnow()
+
+    image_rows, report_rows = [], []
+    known = set(connection.execute(select(Image.filename)).scalars())
+    known.update(connection.execute(select(Report.filename)).scalars())
+    for row in connection.execute(users.select()).mappings():
+        for filename in row.get("images") or []:
+            if filename not in known:
+                known.add(filename)
+                image_rows.append({
+                    "user_id": row["id"],
+                    "filename": filename,
+                    "created_at": _created_at(filename, now),
+                })
+        for filename in row.get("reports") or []:
+            if filename not in known:
+                known.add(filename)
+                report_rows.append({
+                    "user_id": row["id"],
+                    "filename": filename,
+                    "created_at": _created_at(filename, now),
+                })
+
+    if image_rows:
+        connection.execute(Image.__table__.insert(), image_rows)
+
+    if report_rows:
+        # Отчет "<имя>.pdf" строится по снимку "<имя>.png"
+        image_ids = dict(connection.execute(select(Image.filename, Image.id)).all())
+        for row in report_rows:
+            row["image_id"] = image_ids.get(row["filename"][:-len(".pdf")] + ".png")
+        connection.execute(Report.__table__.insert(), report_rows)
+
+    if image_rows or report_rows:
+        logger.info(f"Перенесено изображений: {len(image_rows)}, отчетов: {len(report_rows)}")
+
+    if drop_legacy:
+        for name in legacy:
+            connection.execute(text(f"ALTER TABLE users DROP COLUMN {name}"))
+        logger.info(f"Удалены столбцы: {', '.join(f'users.{name}' for name in legacy)}")
+    return len(image_rows), len(report_rows)
+
+
+def upgrade(engine, drop_legacy=False):
+    """
+    Создает недостающие таблицы и столбцы и переносит данные в одной транзакции
+    """
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        # migrate_user_files блокирует таблицу users в PostgreSQL, поэтому столбцы
+        # добавляются после нее: параллельно стартующие процессы выполняют шаги по очереди
+        result = migrate_user_files(connection, drop_legacy=drop_legacy)
+        add_missing_columns(connection)
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос файлов пользователей в таблицы images и reports")
+    parser.add_argument("--drop-legacy", action="store_true",
+                        help="После переноса удалить JSON-столбцы users.images и users.reports (необратимо)")
+    args = parser.parse_args()
+
+    from .database import engine
+
+    images, reports = upgrade(engine, drop_legacy=args.drop_legacy)
+    print(f"Перенесено изображений: {images}, отчетов: {reports}")
+
+
+if __name__ == "__main__":
+    main()
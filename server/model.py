@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String
-from sqlalchemy.types import JSON
+from datetime import datetime
+from sqlalchemy import Column, Integer, SmallInteger, Float, String, DateTime, ForeignKey, Index, JSON
+from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -11,5 +12,85 @@ class User(Base):
     status = Column(String, nullable=False)
     email = Column(String, nullable=False)
     password = Column(String, nullable=False)
-    images = Column(JSON, nullable=True)
-    reports = Column(JSON, nullable=True)
\ No newline at end of file
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    images = relationship(
+        "Image", back_populates="user", order_by="Image.id",
+        cascade="all, delete-orphan", passive_deletes=True,
+    )
+    reports = relationship(
+        "Report", back_populates="user", order_by="Report.id",
+        cascade="all, delete-orphan", passive_deletes=True,
+    )
+
+class Image(Base):
+    __tablename__ = "images"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    filename = Column(String, nullable=False, unique=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    content_hash = Column(String(64), nullable=True)
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    user = relationship("User", back_populates="images")
+    defects = relationship(
+        "Defect", back_populates="image", order_by="Defect.id",
+        cascade="all, delete-orphan", passive_deletes=True,
+    )
+
+    __table_args__ = (
+        Index("ix_images_user_id_created_at", "user_id", "created_at"),
+    )
+
+class Report(Base):
+    __tablename__ = "reports"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    image_id = Column(Integer, ForeignKey("images.id", ondelete="SET NULL"), nullable=True, index=True)
+    filename = Column(String, nullable=False, unique=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    rects_hash = Column(String(64), nullable=True)
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    user = relationship("User", back_populates="reports")
+
+    __table_args__ = (
+        Index("ix_reports_user_id_created_at", "user_id", "created_at"),
+    )
+
+class Defect(Base):
+    __tablename__ = "defects"
+    id = Column(Integer, primary_key=True)
+    image_id = Column(Integer, ForeignKey("images.id", ondelete="CASCADE"), nullable=False, index=True)
+    class_id = Column(SmallInteger, nullable=False)
+    score = Column(Float, nullable=False)
+    x1 = Column(Float, nullable=False)
+    y1 = Column(Float, nullable=False)
+    x2 = Column(Float, nullable=False)
+    y2 = Column(Float, nullable=False)
+
+    image = relationship("Image", back_populates="defects")
+
+    __table_args__ = (
+        Index("ix_defects_class_id_score", "class_id", "score"),
+        Index("ix_defects_x1_x2", "x1", "x2"),
+    )
+
+class InferenceTask(Base):
+    __tablename__ = "inference_tasks"
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    status = Column(String(16), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    result = Column(JSON, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True, index=True)
+
+    __table_args__ = (
+        Index("ix_inference_tasks_status_available_at", "status", "available_at"),
+    )
\ No newline at end of file
@@ -0,0 +1,82 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MODEL_LOADING = "loading"
+MODEL_WARMING = "warming"
+MODEL_READY = "ready"
+MODEL_FAILED = "failed"
+
+
+class ModelLoader:
+    """
+    Загрузка модели и прогрев в фоновом потоке.
+    Сервер принимает запросы сразу после старта (liveness), а инференс доступен
+    только после загрузки и первого прохода модели (readiness).
+    load() возвращает пару (пул инференса, предиктор с пакетной обработкой или None),
+    warmup(pool) выполняет пробный инференс в каждом воркере пула.
+    """
+
+    def __init__(self, load, warmup=None):
+        self._load = load
+        self._warmup = warmup
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.status = MODEL_LOADING
+        self.error = None
+        self.pool = None
+        self.shared_predictor = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+
+    @property
+    def ready(self):
+        return self.status == MODEL_READY
+
+    def start(self):
+        """
+        Запускает загрузку в фоновом потоке; повторный вызов ничего не делает
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.load, name="model-loader", daemon=True)
+            self._thread.start()
+
+    def load(self):
+        """
+        Синхронная загрузка и прогрев модели
+        """
+        try:
+            start = time.perf_counter()
+            self.pool, self.shared_predictor = self._load()
+            self.load_seconds = time.perf_counter() - start
+            logger.info(f"Модель загружена за {self.load_seconds:.1f} с")
+
+            if self._warmup is not None:
+                self.status = MODEL_WARMING
+                start = time.perf_counter()
+                self._warmup(self.pool)
+                self.warmup_seconds = time.perf_counter() - start
+                logger.info(f"Прогрев модели занял {self.warmup_seconds:.1f} с")
+
+            self.status = MODEL_READY
+        except Exception as e:
+            logger.exception(f"Ошибка при инициализации модели: {e}")
+            self.error = str(e)
+            self.status = MODEL_FAILED
+
+    def stats(self):
+        return {
+            "status": self.status,
+            "error": self.error,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+        }
+
+    def shutdown(self, wait=True):
+        if self.pool is not None:
+            self.pool.shutdown(wait=wait)
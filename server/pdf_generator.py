@@ -1,84 +1,92 @@
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.units import mm
-from .pdf_styles import PDFStyles
+from .pdf_styles import get_pdf_styles
 from .utils.defect_names import DefectNames
 from reportlab.lib import colors
 from collections import Counter
+from functools import lru_cache
+from bisect import bisect_left, bisect_right
 import json
 
 defect_names = DefectNames()
 
+# Мерный пояс: 10 участков по 3000 px начиная с 300 px и участок на стыке пояса
+BELT_START = 300
+SEGMENT_LENGTH = 3000
+SEGMENT_COUNT = 10
+
+
+def bucket_defects(defects_data):
+    """
+    Раскладывает дефекты по участкам мерного пояса за один проход по отсортированным x1.
+    Возвращает список Counter классов дефектов для каждого из SEGMENT_COUNT + 1 участков.
+    Границы участков включаются с обеих сторон, как и раньше; последний участок -
+    стык пояса: x1 <= BELT_START или x1 за концом пояса.
+    """
+    items = sorted((obj['x1'], int(obj['className'])) for obj in defects_data)
+    xs = [x for x, _ in items]
+
+    buckets = []
+    for i in range(SEGMENT_COUNT + 1):
+        low = BELT_START + i * SEGMENT_LENGTH
+        high = low + SEGMENT_LENGTH
+        counter = Counter(cls for _, cls in items[bisect_left(xs, low):bisect_right(xs, high)])
+
+        if i == SEGMENT_COUNT:
+            counter.update(cls for _, cls in items[:bisect_right(xs, BELT_START)])
+            counter.update(cls for _, cls in items[bisect_left(xs, low):])
+
+        buckets.append(counter)
+    return buckets
+
+
+def segment_text(counter):
+    """
+    Описание дефектов участка: "пора(3) включение(1) " или "-"
+    """
+    text = ''
+    for j in range(13):
+        clv = counter.get(j, 0)
+
+        if clv != 0:
+            text += f"{defect_names.get(j)}({clv}) "
+
+    return text or '-'
+
+
+@lru_cache(maxsize=1024)
+def segment_row(index, counts):
+    """
+    Тексты ячеек строки таблицы для участка index; counts - отсортированные пары (класс, количество).
+    Кэшируются только строки: Paragraph хранит состояние верстки, поэтому создается для каждого отчета.
+    """
+    number1 = index * 300
+    number2 = (index + 1) * 300 if index < SEGMENT_COUNT else 0
+
+    # Данные о соединении выводятся только в первой строке (ячейки объединены)
+    first_columns = ["100-400-ЛС", "1020x17", "1CE91939"] if index == 0 else ["", "", ""]
+    return (
+        *first_columns,
+        f"{number1}-{number2}",
+        "0,50",
+        segment_text(dict(counts)),
+        "н/п",
+        "годен",
+        "н/п",
+    )
+
+
 def create_table_data(defects_data):
-    styles = PDFStyles()
-    result = []
-    first_iteration = True
-    ruler = 300
-    for i in range(11):
-
-        number1 = i * 300
-        number2 = (i+1) * 300
-        if i == 10:
-            number2 = 0
-        
-        data = []
-        for obj in defects_data:
-
-            if i == 10:
-                if (obj['x1'] <= 300 or obj['x1'] >= 30300):
-                    data.append(int(obj['className']))
-                else:
-                    continue
-
-            if (ruler <= obj['x1'] <= ruler + 3000):
-                data.append(int(obj['className']))
-            else:
-                continue
-
-        counter = Counter(data)
-        
-        text = ''
-        for j in range(13):
-            clv = counter.get(j, 0)
-
-            if clv != 0:
-                text += f"{defect_names.get(j)}({clv}) "
-
-        if text == '':
-            text = '-'
-        ruler += 3000
-
-        if first_iteration:
-            result.append([
-                Paragraph("100-400-ЛС", styles.get_style("TableStyle")),
-                Paragraph("1020x17", styles.get_style("TableStyle")),
-                Paragraph("1CE91939", styles.get_style("TableStyle")),
-                Paragraph(f"{number1}-{number2}", styles.get_style("TableStyle")),
-                Paragraph("0,50", styles.get_style("TableStyle")),
-                Paragraph(text, styles.get_style("TableStyle")),
-                Paragraph("н/п", styles.get_style("TableStyle")),
-                Paragraph("годен", styles.get_style("TableStyle")),
-                Paragraph("н/п", styles.get_style("TableStyle")),
-            ])
-            first_iteration = False
-        else:
-            result.append([
-                Paragraph("", styles.get_style("TableStyle")),
-                Paragraph("", styles.get_style("TableStyle")),
-                Paragraph("", styles.get_style("TableStyle")),
-                Paragraph(f"{number1}-{number2}", styles.get_style("TableStyle")),
-                Paragraph("0,50", styles.get_style("TableStyle")),
-                Paragraph(text, styles.get_style("TableStyle")),
-                Paragraph("н/п", styles.get_style("TableStyle")),
-                Paragraph("годен", styles.get_style("TableStyle")),
-                Paragraph("н/п", styles.get_style("TableStyle")),
-            ])
-
-    return result
+    table_style = get_pdf_styles().get_style("TableStyle")
+    return [
+        [Paragraph(value, table_style) for value in segment_row(i, tuple(sorted(counter.items())))]
+        for i, counter in enumerate(bucket_defects(defects_data))
+    ]
 
 def create_pdf(file_path: str, output_path: str, defects_data: list):
     output = f"{output_path}/{file_path}.pdf"
-    styles = PDFStyles()
+    styles = get_pdf_styles()
     
     doc = SimpleDocTemplate(
         output,
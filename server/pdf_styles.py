@@ -3,6 +3,7 @@ from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 from reportlab.lib import colors
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+from functools import lru_cache
 import os
 
 class PDFStyles:
@@ -10,7 +11,12 @@ class PDFStyles:
         self.styles = getSampleStyleSheet()
         self._create_styles()
     
-    def register_fonts(self):
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def register_fonts():
+        """
+        Регистрирует шрифты один раз на процесс
+        """
         try:
             # Путь к папке, где лежат arialmt.ttf и arial_bolditalicmt.ttf
             FONT_PATH = os.path.join(os.path.dirname(__file__), 'utils')
@@ -60,4 +66,11 @@ class PDFStyles:
         ))
 
     def get_style(self, style_name):
-        return self.styles[style_name]
\ No newline at end of file
+        return self.styles[style_name]
+
+@lru_cache(maxsize=None)
+def get_pdf_styles():
+    """
+    Общий набор стилей процесса: шрифты и стили создаются один раз
+    """
+    return PDFStyles()
\ No newline at end of file
@@ -0,0 +1,60 @@
+from model.preprocessing import load_matcher
+from model.roi import SeamDetector
+from model.triage import TileScreener, load_classifier
+
+from .config import (
+    TILE_SIZE, TILE_OVERLAP, TILE_BATCH_SIZE, TILE_MERGE, HISTOGRAM_REFERENCE,
+    SEAM_ROI, SEAM_ROI_MARGIN, SEAM_ROI_MIN_MARGIN, SEAM_ROI_MIN_CONTRAST, SEAM_ROI_MAX_FRACTION,
+    TRIAGE, TRIAGE_THRESHOLD, TRIAGE_CLASSIFIER,
+)
+
+
+def pipeline_options():
+    """
+    Параметры process_image из настроек: инференс окнами, выравнивание гистограммы
+    по эталону, обрезка до полосы шва и отсев пустых окон. Общие для API и воркеров очереди.
+    """
+    seam_detector = None
+    if SEAM_ROI:
+        seam_detector = SeamDetector(
+            margin=SEAM_ROI_MARGIN,
+            min_contrast=SEAM_ROI_MIN_CONTRAST,
+            max_fraction=SEAM_ROI_MAX_FRACTION,
+            min_margin=SEAM_ROI_MIN_MARGIN,
+        )
+    screener = None
+    if TRIAGE:
+        screener = TileScreener(
+            threshold=TRIAGE_THRESHOLD,
+            classifier=load_classifier(TRIAGE_CLASSIFIER) if TRIAGE_CLASSIFIER else None,
+        )
+    return {
+        "tile_size": TILE_SIZE,
+        "tile_overlap": TILE_OVERLAP,
+        "tile_batch_size": TILE_BATCH_SIZE,
+        "tile_merge": TILE_MERGE,
+        "preprocess": load_matcher(HISTOGRAM_REFERENCE) if HISTOGRAM_REFERENCE else None,
+        "roi": seam_detector,
+        "screen": screener,
+    }
+
+
+def pipeline_identity(options):
+    """
+    Параметры конвейера options (из pipeline_options) для ключа кэша предсказаний.
+    Выключенные окна, обрезка и отсев в ключ не попадают, поэтому ранее сохраненные
+    результаты без них остаются в силе.
+    """
+    identity = {}
+    if options["tile_size"]:
+        identity["tiling"] = {
+            "size": options["tile_size"],
+            "overlap": options["tile_overlap"],
+            "batch_size": options["tile_batch_size"],
+            "merge": options["tile_merge"],
+        }
+    if options["roi"] is not None:
+        identity["seam_roi"] = options["roi"].identity()
+    if options["screen"] is not None:
+        identity["triage"] = options["screen"].identity()
+    return identity
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """
+    Кэш предсказаний с адресацией по содержимому.
+    Ключ - SHA-256 декодированного изображения и параметров модели
+    (путь к весам, порог SCORE_THRESH_TEST, список классов).
+    Два уровня: LRU в памяти с ограничением по количеству записей
+    и постоянный уровень на диске (по одному JSON-файлу на ключ).
+    """
+
+    def __init__(self, identity, max_entries=256, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._identity = json.dumps(identity, sort_keys=True).encode("utf-8")
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key_for(self, img):
+        """
+        Ключ кэша для декодированного изображения (numpy-массива)
+        """
+        digest = hashlib.sha256(self._identity)
+        digest.update(f"{img.shape}:{img.dtype}".encode("ascii"))
+        if img.flags["C_CONTIGUOUS"]:
+            digest.update(memoryview(img).cast("B"))
+        else:
+            digest.update(img.tobytes())
+        return digest.hexdigest()
+
+    def key_for_file(self, file_hash):
+        """
+        Ключ кэша по SHA-256 исходного файла: позволяет найти результат без декодирования
+        """
+        digest = hashlib.sha256(self._identity)
+        digest.update(b"file:")
+        digest.update(file_hash.encode("ascii"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key, record_miss=True):
+        """
+        Результат по ключу или None.
+        record_miss=False - предварительная проверка, промах которой не учитывается в статистике.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+
+        result = self._read_disk(key)
+        with self._lock:
+            if result is None:
+                if record_miss:
+                    self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, result)
+        return result
+
+    def put(self, key, result):
+        if result is None:
+            return
+        with self._lock:
+            self._remember(key, result)
+        self._write_disk(key, result)
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, result):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Запись во временный файл и атомарная замена, чтобы не читать недописанный JSON
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            # numpy-массивы результата сохраняются списками
+            json.dump(result, f, default=lambda value: value.tolist())
+        os.replace(tmp_path, path)
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": hits / total if total else 0.0,
+            }
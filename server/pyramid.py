@@ -0,0 +1,198 @@
+import json
+import math
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from . import metrics
+
+PYRAMID_PENDING = "pending"
+PYRAMID_READY = "ready"
+PYRAMID_FAILED = "failed"
+PYRAMID_MISSING = "missing"
+
+DZI_NAME = "image.dzi"
+TILES_DIR = "image_files"
+THUMBNAIL_NAME = "thumbnail.jpg"
+STATE_NAME = "pyramid.json"
+
+DZI_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="jpg" Overlap="{overlap}" TileSize="{tile_size}">\n'
+    '  <Size Width="{width}" Height="{height}"/>\n'
+    '</Image>\n'
+)
+
+
+def decode_for_tiles(data):
+    """
+    Декодирует снимок для пирамиды: одноканальные снимки остаются одноканальными,
+    16-битные приводятся к 8 битам, альфа-канал отбрасывается
+    """
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError("Не удалось декодировать изображение")
+    if img.dtype == np.uint16:
+        img = (img >> 8).astype(np.uint8)
+    if img.ndim == 3 and img.shape[2] == 4:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+    return img
+
+
+def level_count(width, height):
+    """
+    Количество уровней Deep Zoom: от 1x1 px (уровень 0) до полного размера
+    """
+    return int(math.ceil(math.log2(max(width, height, 1)))) + 1
+
+
+def _halve(img):
+    height, width = img.shape[:2]
+    size = ((width + 1) // 2, (height + 1) // 2)
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+
+def write_level_tiles(img, level_dir, tile_size, overlap, quality):
+    """
+    Режет уровень пирамиды на тайлы "<столбец>_<строка>.jpg" с перекрытием overlap
+    """
+    os.makedirs(level_dir, exist_ok=True)
+    height, width = img.shape[:2]
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+    for row in range(int(math.ceil(height / tile_size))):
+        y0 = max(row * tile_size - overlap, 0)
+        y1 = min((row + 1) * tile_size + overlap, height)
+        for col in range(int(math.ceil(width / tile_size))):
+            x0 = max(col * tile_size - overlap, 0)
+            x1 = min((col + 1) * tile_size + overlap, width)
+            ok, encoded = cv2.imencode(".jpg", img[y0:y1, x0:x1], params)
+            if not ok:
+                raise ValueError(f"Не удалось закодировать тайл {col}_{row}")
+            with open(os.path.join(level_dir, f"{col}_{row}.jpg"), "wb") as f:
+                f.write(encoded.tobytes())
+
+
+def build_pyramid(img, output_dir, tile_size=254, overlap=1, quality=85, thumbnail_size=1024):
+    """
+    Строит пирамиду Deep Zoom (image.dzi и image_files/<уровень>/<столбец>_<строка>.jpg)
+    и миниатюру thumbnail.jpg. Уровни получаются последовательным уменьшением вдвое
+    от полного размера, поэтому снимок целиком масштабируется только один раз на уровень.
+    """
+    height, width = img.shape[:2]
+    os.makedirs(output_dir, exist_ok=True)
+
+    thumbnail_written = False
+    level = img
+    for index in reversed(range(level_count(width, height))):
+        level_height, level_width = level.shape[:2]
+        write_level_tiles(level, os.path.join(output_dir, TILES_DIR, str(index)), tile_size, overlap, quality)
+
+        # Миниатюра - первый уровень, помещающийся в thumbnail_size
+        if not thumbnail_written and max(level_width, level_height) <= thumbnail_size:
+            cv2.imwrite(os.path.join(output_dir, THUMBNAIL_NAME), level, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            thumbnail_written = True
+
+        if index > 0:
+            level = _halve(level)
+
+    with open(os.path.join(output_dir, DZI_NAME), "w", encoding="utf-8") as f:
+        f.write(DZI_TEMPLATE.format(overlap=overlap, tile_size=tile_size, width=width, height=height))
+
+    return {"width": width, "height": height}
+
+
+class PyramidStore:
+    """
+    Пирамиды снимков в root_dir/<имя снимка>/<версия>/.
+    Версия - префикс хэша содержимого: при замене снимка строится новая версия,
+    поэтому файлы версии не меняются и могут кэшироваться навсегда.
+    Текущая версия записывается в root_dir/<имя снимка>/pyramid.json после построения.
+    """
+
+    def __init__(self, root_dir, tile_size=254, overlap=1, quality=85, thumbnail_size=1024, workers=1):
+        self.root_dir = root_dir
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.quality = quality
+        self.thumbnail_size = thumbnail_size
+        self._executor = ThreadPoolExecutor(max_workers=max(int(workers), 1), thread_name_prefix="pyramid")
+        self._lock = threading.Lock()
+        self._pending = {}
+        os.makedirs(root_dir, exist_ok=True)
+
+    @staticmethod
+    def name_for(filename):
+        return os.path.splitext(os.path.basename(filename))[0]
+
+    def _image_dir(self, filename):
+        return os.path.join(self.root_dir, self.name_for(filename))
+
+    def submit(self, filename, data, content_hash):
+        """
+        Ставит построение пирамиды в очередь, возвращает concurrent Future
+        """
+        version = content_hash[:16]
+        with self._lock:
+            self._pending[filename] = version
+        return self._executor.submit(self._build, filename, data, version)
+
+    def _build(self, filename, data, version):
+        image_dir = self._image_dir(filename)
+        version_dir = os.path.join(image_dir, version)
+        try:
+            with metrics.stage("pyramid_build"):
+                size = build_pyramid(
+                    decode_for_tiles(data), version_dir,
+                    self.tile_size, self.overlap, self.quality, self.thumbnail_size,
+                )
+            previous = self._read_state(filename)
+            self._write_state(filename, {"status": PYRAMID_READY, "version": version, **size})
+            if previous and previous.get("version") not in (None, version):
+                shutil.rmtree(os.path.join(image_dir, previous["version"]), ignore_errors=True)
+        except Exception as e:
+            shutil.rmtree(version_dir, ignore_errors=True)
+            self._write_state(filename, {"status": PYRAMID_FAILED, "error": str(e)})
+            raise
+        finally:
+            with self._lock:
+                if self._pending.get(filename) == version:
+                    del self._pending[filename]
+
+    def _read_state(self, filename):
+        try:
+            with open(os.path.join(self._image_dir(filename), STATE_NAME), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_state(self, filename, state):
+        image_dir = self._image_dir(filename)
+        os.makedirs(image_dir, exist_ok=True)
+        tmp_path = os.path.join(image_dir, f".{STATE_NAME}.{threading.get_ident()}")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, os.path.join(image_dir, STATE_NAME))
+
+    def state(self, filename):
+        """
+        Состояние пирамиды снимка; во время перестроения отдается предыдущая готовая версия
+        """
+        with self._lock:
+            pending = filename in self._pending
+        state = self._read_state(filename)
+        if state is None:
+            return {"status": PYRAMID_PENDING if pending else PYRAMID_MISSING}
+        if pending and state["status"] != PYRAMID_READY:
+            return {"status": PYRAMID_PENDING}
+        return {**state, "rebuilding": pending}
+
+    def delete(self, filename):
+        shutil.rmtree(self._image_dir(filename), ignore_errors=True)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,76 @@
+import asyncio
+import hashlib
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .pdf_generator import create_pdf
+from .pdf_styles import get_pdf_styles
+
+
+def _init_worker():
+    # Шрифты и стили загружаются один раз при старте процесса, а не на каждый отчет
+    get_pdf_styles()
+
+
+def rects_digest(rects):
+    """
+    Хэш набора прямоугольников без учета порядка и порядка ключей:
+    одинаковая разметка, сохраненная повторно, дает тот же хэш
+    """
+    normalized = sorted(json.dumps(rect, sort_keys=True, ensure_ascii=False) for rect in rects)
+    return hashlib.sha256(json.dumps(normalized).encode()).hexdigest()
+
+
+def render_report(base_filename, output_dir, rects):
+    """
+    Строит PDF-отчет и возвращает имя файла отчета
+    """
+    create_pdf(base_filename, output_dir, rects)
+    return f"{base_filename}.pdf"
+
+
+class ReportEngine:
+    """
+    Построение PDF-отчетов в пуле процессов, чтобы сборка ReportLab не блокировала API.
+    При workers=0 отчеты строятся в потоке текущего процесса.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = max(int(workers), 0)
+        self._executor = None
+        if self.workers:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+
+    async def render(self, base_filename, output_dir, rects):
+        """
+        Строит отчет base_filename.pdf в output_dir, не блокируя цикл событий
+        """
+        if self._executor is None:
+            return await asyncio.to_thread(render_report, base_filename, output_dir, rects)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, render_report, base_filename, output_dir, rects)
+
+    async def render_many(self, output_dir, reports):
+        """
+        Параллельное построение отчетов: reports - список пар (base_filename, rects).
+        Возвращает для каждого отчета имя PDF или исключение.
+        """
+        return await asyncio.gather(
+            *(self.render(base_filename, output_dir, rects) for base_filename, rects in reports),
+            return_exceptions=True,
+        )
+
+    def stats(self):
+        return {
+            "mode": "process" if self._executor is not None else "thread",
+            "workers": self.workers or 1,
+        }
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
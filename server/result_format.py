@@ -0,0 +1,82 @@
+import numpy as np
+from starlette.responses import JSONResponse, Response
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# Типы упакованных столбцов: рамки (N x 4) и уверенности - float32, классы - uint8 (13 классов)
+PACKED_DTYPES = {
+    "pred_boxes": "<f4",
+    "scores": "<f4",
+    "pred_classes": "<u1",
+}
+
+
+def _is_instances(value):
+    return isinstance(value, dict) and "pred_boxes" in value and "scores" in value
+
+
+def _map_instances(payload, fn):
+    """
+    Применяет fn ко всем словарям instances внутри ответа (вложенные словари и списки)
+    """
+    if isinstance(payload, dict):
+        return {key: fn(value) if key == "instances" and _is_instances(value) else _map_instances(value, fn)
+                for key, value in payload.items()}
+    if isinstance(payload, list):
+        return [_map_instances(item, fn) for item in payload]
+    return payload
+
+
+def instances_to_lists(instances):
+    return {key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in instances.items()}
+
+
+def pack_instances(instances):
+    """
+    Столбцовое представление: массивы рамок, уверенностей и классов в виде сырых байт little-endian
+    """
+    packed = dict(instances)
+    for key, dtype in PACKED_DTYPES.items():
+        packed[key] = np.ascontiguousarray(np.asarray(instances[key]), dtype=dtype).tobytes()
+    packed["encoding"] = PACKED_DTYPES
+    return packed
+
+
+def unpack_instances(packed):
+    """
+    Обратное преобразование упакованных instances в numpy-массивы
+    """
+    instances = {key: value for key, value in packed.items() if key != "encoding"}
+    for key, dtype in packed.get("encoding", PACKED_DTYPES).items():
+        instances[key] = np.frombuffer(packed[key], dtype=dtype)
+    instances["pred_boxes"] = instances["pred_boxes"].reshape(-1, 4)
+    return instances
+
+
+def to_jsonable(payload):
+    """
+    Ответ с результатами модели в виде, пригодном для JSON (numpy-массивы -> списки)
+    """
+    return _map_instances(payload, instances_to_lists)
+
+
+def wants_msgpack(request):
+    accept = request.headers.get("accept", "")
+    return msgpack is not None and any(content_type in accept for content_type in MSGPACK_CONTENT_TYPES)
+
+
+def result_response(request, payload, status_code=200, headers=None):
+    """
+    Ответ с результатами модели: JSON по умолчанию или msgpack со столбцовыми
+    float32-массивами при Accept: application/msgpack
+    """
+    headers = {**(headers or {}), "Vary": "Accept"}
+    if wants_msgpack(request):
+        content = msgpack.packb(_map_instances(payload, pack_instances), use_bin_type=True)
+        return Response(content, status_code=status_code, headers=headers, media_type=MSGPACK_CONTENT_TYPES[0])
+    return JSONResponse(to_jsonable(payload), status_code=status_code, headers=headers)
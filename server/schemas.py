@@ -1,16 +1,31 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 from typing import List, Optional
 
-class UserCreate(BaseModel):
+class UserBase(BaseModel):
     fullName: str
     status: str
     email: str
-    password: str
     images: Optional[List[str]] = None
     reports: Optional[List[str]] = None
 
-class UserOut(UserCreate):
+class UserCreate(UserBase):
+    password: str
+
+class UserOut(UserBase):
     id: int
 
+    @validator("images", "reports", pre=True)
+    def filenames(cls, value):
+        # Связанные записи Image/Report выводятся списком имен файлов
+        return [getattr(item, "filename", item) for item in value or []]
+
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class ReportRequest(BaseModel):
+    filename: str
+    rects: List[dict]
+
+class BatchReportRequest(BaseModel):
+    userId: int
+    reports: List[ReportRequest]
@@ -0,0 +1,207 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+
+from .defect_store import defect_rows
+from .jobs import JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, FINISHED_STATUSES
+from .model import Defect, Image, InferenceTask
+
+
+def _timestamp(value):
+    return (value - datetime(1970, 1, 1)).total_seconds() if value is not None else None
+
+
+def task_to_dict(task):
+    """
+    Задача очереди в формате ответа /jobs/{id} (как Job.to_dict)
+    """
+    return {
+        "jobId": task.id,
+        "status": task.status,
+        "filename": task.filename,
+        "defects": task.result,
+        "error": task.error,
+        "createdAt": _timestamp(task.created_at),
+        "finishedAt": _timestamp(task.finished_at),
+    }
+
+
+async def enqueue_task(db, task_id, user_id, filename):
+    """
+    Ставит задачу в очередь; повторная постановка той же задачи ничего не делает
+    (commit - на вызывающей стороне)
+    """
+    if await db.scalar(select(InferenceTask.id).where(InferenceTask.id == task_id)) is None:
+        db.add(InferenceTask(id=task_id, user_id=user_id, filename=filename, status=JOB_QUEUED))
+
+
+async def wait_for_task(session_factory, task_id, timeout=None, interval=0.5, on_running=None):
+    """
+    Опрос задачи до завершения. Возвращает задачу (незавершенную - по истечении timeout)
+    или None, если задачи нет. on_running вызывается один раз, когда воркер взял задачу.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    running = False
+    while True:
+        async with session_factory() as db:
+            task = await db.get(InferenceTask, task_id)
+        if task is None or task.status in FINISHED_STATUSES:
+            return task
+        if task.status == JOB_RUNNING and not running and on_running is not None:
+            running = True
+            on_running()
+        if deadline is not None and time.monotonic() >= deadline:
+            return task
+        await asyncio.sleep(interval)
+
+
+async def task_stats(db):
+    counts = dict((await db.execute(
+        select(InferenceTask.status, func.count(InferenceTask.id)).group_by(InferenceTask.status)
+    )).all())
+    return {status: counts.get(status, 0) for status in (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)}
+
+
+class TaskQueue:
+    """
+    Сторона воркера очереди inference_tasks (синхронные сессии SQLAlchemy).
+    Воркер берет задачу в аренду на lease_seconds и продлевает ее, пока работает;
+    задачу с истекшей арендой (воркер упал) может взять другой воркер.
+    Ошибка возвращает задачу в очередь с экспоненциальной задержкой,
+    после max_attempts попыток задача завершается с ошибкой.
+    """
+
+    def __init__(self, lease_seconds=120, max_attempts=3, retry_backoff=5.0):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+
+    @staticmethod
+    def _claimable(now):
+        return or_(
+            and_(InferenceTask.status == JOB_QUEUED, InferenceTask.available_at <= now),
+            and_(InferenceTask.status == JOB_RUNNING, InferenceTask.lease_expires_at < now),
+        )
+
+    def claim(self, session, worker_id):
+        """
+        Берет в аренду самую старую доступную задачу или возвращает None.
+        В PostgreSQL строка выбирается с FOR UPDATE SKIP LOCKED, поэтому воркеры не ждут
+        друг друга; условие в UPDATE защищает от двойного захвата и в SQLite.
+        """
+        while True:
+            now = datetime.utcnow()
+            task = session.execute(
+                select(InferenceTask)
+                .where(self._claimable(now))
+                .order_by(InferenceTask.created_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            ).scalar()
+            if task is None:
+                session.rollback()
+                return None
+
+            if task.attempts >= self.max_attempts:
+                # Аренда истекла на последней попытке: воркер, скорее всего, падает на этом снимке
+                session.execute(
+                    update(InferenceTask)
+                    .where(InferenceTask.id == task.id, self._claimable(now))
+                    .values(status=JOB_FAILED, finished_at=now, lease_owner=None,
+                            error=task.error or "Истекла аренда задачи")
+                )
+                session.commit()
+                continue
+
+            claimed = session.execute(
+                update(InferenceTask)
+                .where(InferenceTask.id == task.id, self._claimable(now))
+                .values(
+                    status=JOB_RUNNING,
+                    lease_owner=worker_id,
+                    lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                    attempts=InferenceTask.attempts + 1,
+                )
+            ).rowcount
+            session.commit()
+            if claimed:
+                session.refresh(task)
+                return task
+
+    def _owned(self, task_id, worker_id):
+        return and_(
+            InferenceTask.id == task_id,
+            InferenceTask.status == JOB_RUNNING,
+            InferenceTask.lease_owner == worker_id,
+        )
+
+    def heartbeat(self, session, task_id, worker_id):
+        """
+        Продлевает аренду; False - аренда потеряна (задачу забрал другой воркер)
+        """
+        extended = session.execute(
+            update(InferenceTask)
+            .where(self._owned(task_id, worker_id))
+            .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=self.lease_seconds))
+        ).rowcount
+        session.commit()
+        return bool(extended)
+
+    def complete(self, session, task, worker_id, result):
+        """
+        Сохраняет результат и дефекты снимка в одной транзакции.
+        Дефекты заменяются целиком, поэтому повторная запись того же результата безопасна.
+        Возвращает False, если аренда потеряна и результат отброшен.
+        """
+        now = datetime.utcnow()
+        completed = session.execute(
+            update(InferenceTask)
+            .where(self._owned(task.id, worker_id))
+            .values(status=JOB_DONE, result=result, error=None, finished_at=now, lease_owner=None)
+        ).rowcount
+        if not completed:
+            session.rollback()
+            return False
+
+        image_id = session.scalar(select(Image.id).where(Image.filename == task.filename))
+        if image_id is not None:
+            session.execute(delete(Defect).where(Defect.image_id == image_id))
+            rows = defect_rows(image_id, result)
+            if rows:
+                session.execute(insert(Defect), rows)
+        session.commit()
+        return True
+
+    def fail(self, session, task, worker_id, error):
+        """
+        Возвращает задачу в очередь с задержкой retry_backoff * 2^(попытка - 1)
+        или завершает ее с ошибкой после max_attempts попыток
+        """
+        now = datetime.utcnow()
+        if task.attempts >= self.max_attempts:
+            values = {"status": JOB_FAILED, "finished_at": now}
+        else:
+            delay = self.retry_backoff * 2 ** (task.attempts - 1)
+            values = {"status": JOB_QUEUED, "available_at": now + timedelta(seconds=delay)}
+        session.execute(
+            update(InferenceTask)
+            .where(self._owned(task.id, worker_id))
+            .values(error=error, lease_owner=None, lease_expires_at=None, **values)
+        )
+        session.commit()
+        return values["status"]
+
+    def purge(self, session, ttl_seconds):
+        """
+        Удаляет завершенные задачи старше ttl_seconds
+        """
+        removed = session.execute(
+            delete(InferenceTask).where(
+                InferenceTask.status.in_(FINISHED_STATUSES),
+                InferenceTask.finished_at < datetime.utcnow() - timedelta(seconds=ttl_seconds),
+            )
+        ).rowcount
+        session.commit()
+        return removed
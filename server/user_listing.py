@@ -0,0 +1,95 @@
+import base64
+import hashlib
+
+from sqlalchemy import func, select
+
+from .model import User, Image, Report
+
+# Поля пользователя, доступные для выборки (пароль не отдается никогда)
+USER_FIELDS = ("id", "fullName", "status", "email", "images", "reports")
+FILE_FIELDS = {"images": Image, "reports": Report}
+
+
+class InvalidListingParams(ValueError):
+    """
+    Некорректный курсор или список полей
+    """
+
+
+def parse_fields(value):
+    """
+    Разбор параметра fields ("id,fullName,email"); id выводится всегда
+    """
+    if not value:
+        return USER_FIELDS
+    fields = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = sorted(set(fields) - set(USER_FIELDS))
+    if unknown:
+        raise InvalidListingParams(f"Неизвестные поля: {', '.join(unknown)}")
+    return tuple(name for name in USER_FIELDS if name == "id" or name in fields)
+
+
+def encode_cursor(user_id):
+    return base64.urlsafe_b64encode(str(user_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    except ValueError:
+        raise InvalidListingParams("Некорректный курсор")
+
+
+async def listing_etag(db, fields, after_id, limit):
+    """
+    Слабый ETag страницы по состоянию таблиц: количество строк, последний id и время
+    последнего изменения строки. Удаление меняет количество, добавление и изменение -
+    updated_at, в том числе когда SQLite выдает новой строке id удаленной.
+    Считается без выборки самих строк.
+    """
+    tables = [User] + [FILE_FIELDS[name] for name in fields if name in FILE_FIELDS]
+    state = [
+        tuple((await db.execute(
+            select(func.count(table.id), func.max(table.id), func.max(table.updated_at))
+        )).one())
+        for table in tables
+    ]
+    digest = hashlib.sha1(repr((fields, after_id, limit, state)).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+
+async def list_users(db, fields, after_id=None, limit=100):
+    """
+    Страница пользователей с id больше after_id (keyset-пагинация).
+    Выбираются только запрошенные столбцы; списки файлов - одним запросом на страницу.
+    Возвращает (записи, курсор следующей страницы или None).
+    """
+    columns = [getattr(User, name) for name in fields if name not in FILE_FIELDS]
+    query = select(*columns).order_by(User.id)
+    if after_id is not None:
+        query = query.where(User.id > after_id)
+
+    # Лишняя строка показывает, есть ли следующая страница
+    rows = (await db.execute(query.limit(limit + 1))).all()
+    has_more = len(rows) > limit
+    items = [dict(row._mapping) for row in rows[:limit]]
+
+    if items:
+        ids = [item["id"] for item in items]
+        for name in fields:
+            if name not in FILE_FIELDS:
+                continue
+            table = FILE_FIELDS[name]
+            files = {user_id: [] for user_id in ids}
+            result = await db.execute(
+                select(table.user_id, table.filename).where(table.user_id.in_(ids)).order_by(table.id)
+            )
+            for user_id, filename in result:
+                files[user_id].append(filename)
+            for item in items:
+                item[name] = files[item["id"]]
+
+    next_cursor = encode_cursor(items[-1]["id"]) if has_more else None
+    return items, next_cursor
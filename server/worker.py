@@ -0,0 +1,168 @@
+"""
+Воркер очереди инференса (INFERENCE_QUEUE=db): берет задачи из таблицы inference_tasks,
+прогоняет снимки через модель и записывает результат и дефекты в базу.
+Узлы API только ставят задачи в очередь, поэтому воркеров можно запускать
+на отдельных машинах с GPU и добавлять по мере роста нагрузки:
+    python -m server.worker
+Снимки читаются из UPLOAD_DIR, общего с узлами API.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+
+from model.decoding import decode_gray
+from model.process_image import process_image
+
+from .config import (
+    LOG_LEVEL, MODEL_PATH, UPLOAD_DIR, INFERENCE_BACKEND, EXPORT_DIR, DECODE_SPILL_DIR,
+    JOB_TTL_SECONDS, QUEUE_LEASE_SECONDS, QUEUE_MAX_ATTEMPTS, QUEUE_RETRY_BACKOFF, QUEUE_POLL_INTERVAL,
+)
+from .inference_pool import build_predictor
+from .logging_setup import setup_logging
+from .pipeline import pipeline_options
+from .task_queue import TaskQueue
+
+logger = logging.getLogger(__name__)
+
+# Завершенные задачи удаляются не чаще раза в минуту
+PURGE_INTERVAL = 60
+
+
+class Heartbeat(threading.Thread):
+    """
+    Продлевает аренду задачи каждые lease_seconds / 3, пока идет инференс
+    """
+
+    def __init__(self, queue, session_factory, task_id, worker_id):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.session_factory = session_factory
+        self.task_id = task_id
+        self.worker_id = worker_id
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.queue.lease_seconds / 3):
+            try:
+                with self.session_factory() as session:
+                    if not self.queue.heartbeat(session, self.task_id, self.worker_id):
+                        return
+            except Exception as e:
+                logger.warning("Не удалось продлить аренду задачи %s: %s", self.task_id, e)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+class Worker:
+    def __init__(self, queue, session_factory, predictor, pipeline=None,
+                 upload_dir=UPLOAD_DIR, spill_dir=None, worker_id=None):
+        self.queue = queue
+        self.session_factory = session_factory
+        self.predictor = predictor
+        self.pipeline = pipeline or {}
+        self.upload_dir = upload_dir
+        self.spill_dir = spill_dir
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.stopping = threading.Event()
+
+    def infer(self, filename):
+        img = decode_gray(os.path.join(self.upload_dir, filename), self.spill_dir)
+        if img is None:
+            raise ValueError(f"Не удалось прочитать снимок {filename}")
+        return process_image(self.predictor, img, None, **self.pipeline)
+
+    def run_once(self):
+        """
+        Обрабатывает одну задачу; False - очередь пуста
+        """
+        with self.session_factory() as session:
+            task = self.queue.claim(session, self.worker_id)
+            if task is None:
+                return False
+
+            logger.info("Задача %s (%s), попытка %d", task.id, task.filename, task.attempts)
+            heartbeat = Heartbeat(self.queue, self.session_factory, task.id, self.worker_id)
+            heartbeat.start()
+            try:
+                result = self.infer(task.filename)
+            except Exception as e:
+                heartbeat.stop()
+                logger.error("Ошибка обработки задачи %s: %s", task.id, e)
+                status = self.queue.fail(session, task, self.worker_id, str(e))
+                logger.info("Задача %s: %s", task.id, status)
+                return True
+            heartbeat.stop()
+
+            if not self.queue.complete(session, task, self.worker_id, result):
+                logger.warning("Аренда задачи %s потеряна, результат отброшен", task.id)
+            return True
+
+    def purge(self, ttl_seconds):
+        with self.session_factory() as session:
+            removed = self.queue.purge(session, ttl_seconds)
+        if removed:
+            logger.info("Удалено завершенных задач: %d", removed)
+
+    def run(self, poll_interval=QUEUE_POLL_INTERVAL, once=False, ttl_seconds=JOB_TTL_SECONDS):
+        logger.info("Воркер %s запущен", self.worker_id)
+        last_purge = 0.0
+        while not self.stopping.is_set():
+            try:
+                busy = self.run_once()
+            except Exception as e:
+                # База недоступна и т.п.: пробуем снова после паузы
+                logger.error("Ошибка очереди: %s", e)
+                busy = False
+            if once and not busy:
+                break
+            if time.monotonic() - last_purge >= PURGE_INTERVAL:
+                last_purge = time.monotonic()
+                try:
+                    self.purge(ttl_seconds)
+                except Exception as e:
+                    logger.warning("Не удалось удалить завершенные задачи: %s", e)
+            if not busy:
+                self.stopping.wait(poll_interval)
+        logger.info("Воркер %s остановлен", self.worker_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воркер очереди инференса")
+    parser.add_argument("--poll-interval", type=float, default=QUEUE_POLL_INTERVAL,
+                        help="Пауза между опросами пустой очереди, с")
+    parser.add_argument("--once", action="store_true",
+                        help="Обработать накопившиеся задачи и завершиться")
+    args = parser.parse_args()
+
+    setup_logging(LOG_LEVEL)
+
+    from .database import SessionLocal
+
+    if DECODE_SPILL_DIR:
+        os.makedirs(DECODE_SPILL_DIR, exist_ok=True)
+
+    worker = Worker(
+        TaskQueue(QUEUE_LEASE_SECONDS, QUEUE_MAX_ATTEMPTS, QUEUE_RETRY_BACKOFF),
+        SessionLocal,
+        build_predictor(MODEL_PATH, 1, 0, INFERENCE_BACKEND, EXPORT_DIR),
+        pipeline_options(),
+        spill_dir=DECODE_SPILL_DIR or None,
+    )
+
+    # Текущая задача дорабатывается до конца; незавершенную после SIGKILL
+    # заберет другой воркер, когда истечет аренда
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: worker.stopping.set())
+
+    worker.run(poll_interval=args.poll_interval, once=args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# server.database и server.main читают настройки при импорте
+_tmp = tempfile.mkdtemp(prefix="server-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'test.db')}")
+os.environ.setdefault("UPLOAD_DIR", os.path.join(_tmp, "images"))
+os.environ.setdefault("PREDICTION_CACHE_DIR", "")
@@ -0,0 +1,68 @@
+import pytest
+
+# Приложение импортирует модель (torch, detectron2); сама модель в тестах не запускается
+pytest.importorskip("torch")
+
+from fastapi.testclient import TestClient
+
+from server.main import app, job_store
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def jobs():
+    created = []
+
+    def finish(user_id, result):
+        job = job_store.create(user_id, f"{user_id}.png")
+        job_store.finish(job, result)
+        created.append(job)
+        return job
+
+    yield finish
+    for job in created:
+        job_store.discard(job)
+
+
+def defects(**params):
+    return client.get("/defects", params=params)
+
+
+def test_job_id(jobs):
+    job = jobs(1, [{"x1": 1}])
+    response = defects(jobId=job.id)
+    assert response.status_code == 200
+    assert response.json() == {"user": {"defects": [{"x1": 1}]}}
+
+
+def test_job_id_of_same_user(jobs):
+    job = jobs(1, [{"x1": 1}])
+    assert defects(jobId=job.id, userId=1).status_code == 200
+
+
+def test_job_id_of_other_user_is_not_found(jobs):
+    job = jobs(1, [{"x1": 1}])
+    assert defects(jobId=job.id, userId=2).status_code == 404
+
+
+def test_unknown_job_id_is_not_found():
+    assert defects(jobId="missing").status_code == 404
+
+
+def test_user_id_returns_latest_result_of_that_user(jobs):
+    jobs(101, [{"x1": 1}])
+    jobs(102, [{"x1": 2}])
+    jobs(101, [{"x1": 3}])
+    assert defects(userId=101).json() == {"user": {"defects": [{"x1": 3}]}}
+    assert defects(userId=102).json() == {"user": {"defects": [{"x1": 2}]}}
+
+
+def test_user_without_results_is_not_found():
+    assert defects(userId=999).status_code == 404
+
+
+def test_without_parameters_is_bad_request(jobs):
+    # Раньше отдавался последний результат любого пользователя
+    jobs(1, [{"x1": 1}])
+    assert defects().status_code == 400
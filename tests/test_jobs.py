@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from server.jobs import JobStore, JobStoreFullError
+
+
+def finished_job(store, user_id, result):
+    job = store.create(user_id, f"{user_id}.png")
+    store.finish(job, result)
+    return job
+
+
+def test_latest_result_is_per_user():
+    store = JobStore()
+    finished_job(store, 1, ["a"])
+    finished_job(store, 2, ["b"])
+    finished_job(store, 1, ["c"])
+    assert store.latest_result(1) == ["c"]
+    assert store.latest_result(2) == ["b"]
+    assert store.latest_result(3) is None
+
+
+def test_latest_result_skips_failed_and_discarded_jobs():
+    store = JobStore()
+    finished_job(store, 1, ["a"])
+    store.fail(store.create(1, "failed.png"), "ошибка")
+    store.discard(finished_job(store, 1, ["discarded"]))
+    assert store.latest_result(1) == ["a"]
+
+
+def test_latest_result_expires_with_job():
+    store = JobStore(ttl_seconds=0)
+    job = finished_job(store, 1, ["a"])
+    job.finished_at = time.time() - 1
+    assert store.latest_result(1) is None
+    assert store.get(job.id) is None
+
+
+def test_latest_result_evicted_on_overflow():
+    store = JobStore(max_jobs=2)
+    finished_job(store, 1, ["a"])
+    finished_job(store, 2, ["b"])
+    finished_job(store, 3, ["c"])
+    assert store.latest_result(1) is None
+    assert store.latest_result(3) == ["c"]
+
+
+def test_create_fails_when_all_jobs_are_running():
+    store = JobStore(max_jobs=1)
+    store.create(1, "a.png")
+    with pytest.raises(JobStoreFullError):
+        store.create(1, "b.png")
@@ -0,0 +1,41 @@
+from server import metrics
+
+
+def sample(name, **labels):
+    return metrics.registry.get_sample_value(name, labels)
+
+
+def test_stage_observes_histogram_and_server_timing():
+    before = sample("radex_stage_duration_seconds_count", stage="test_stage") or 0
+    token = metrics.start_request_timing()
+    with metrics.stage("test_stage"):
+        pass
+    metrics.record_stage("test_other", 0.0125)
+    header = metrics.finish_request_timing(token)
+
+    assert sample("radex_stage_duration_seconds_count", stage="test_stage") == before + 1
+    assert header.startswith("test_stage;dur=")
+    assert header.endswith(", test_other;dur=12.5")
+
+
+def test_stage_outside_request_only_observes():
+    with metrics.stage("test_background"):
+        pass
+    assert sample("radex_stage_duration_seconds_count", stage="test_background") >= 1
+
+
+def test_callback_metrics_are_read_on_collect():
+    state = {"value": None}
+    metrics.gauge_callback("radex_test_gauge", "Тестовый gauge", lambda: state["value"])
+    metrics.counter_callback("radex_test_events_total", "Тестовый counter", lambda: 7)
+
+    # None - ряд не выводится
+    assert sample("radex_test_gauge") is None
+    state["value"] = 3
+    assert sample("radex_test_gauge") == 3
+    assert sample("radex_test_events_total") == 7
+
+    text = metrics.render().decode()
+    assert "# TYPE radex_test_gauge gauge" in text
+    assert "radex_test_events_total 7.0" in text
+    assert "_created" not in text
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from server import pipeline
+from server.prediction_cache import PredictionCache
+
+BASE_IDENTITY = {"weights": "/app/model/utils/model.pth", "backend": "eager"}
+
+
+def cache_key(monkeypatch, **settings):
+    for name, value in settings.items():
+        monkeypatch.setattr(pipeline, name, value)
+    cache = PredictionCache({**BASE_IDENTITY, **pipeline.pipeline_identity(pipeline.pipeline_options())})
+    return cache.key_for(np.zeros((16, 16), dtype=np.uint8))
+
+
+@pytest.fixture
+def tiled(monkeypatch):
+    monkeypatch.setattr(pipeline, "SEAM_ROI", False)
+    monkeypatch.setattr(pipeline, "TRIAGE", False)
+    monkeypatch.setattr(pipeline, "HISTOGRAM_REFERENCE", "")
+    return {"TILE_SIZE": 1024, "TILE_OVERLAP": 128, "TILE_BATCH_SIZE": 4, "TILE_MERGE": "nms"}
+
+
+@pytest.mark.parametrize("name, value", [
+    ("TILE_SIZE", 2048),
+    ("TILE_OVERLAP", 256),
+    ("TILE_BATCH_SIZE", 8),
+    ("TILE_MERGE", "wbf"),
+])
+def test_tile_setting_changes_key(monkeypatch, tiled, name, value):
+    assert cache_key(monkeypatch, **tiled) != cache_key(monkeypatch, **{**tiled, name: value})
+
+
+def test_key_without_tiling_ignores_tile_settings(monkeypatch, tiled):
+    off = {**tiled, "TILE_SIZE": 0}
+    assert cache_key(monkeypatch, **off) == cache_key(monkeypatch, **{**off, "TILE_OVERLAP": 256})
+    assert pipeline.pipeline_identity(pipeline.pipeline_options()) == {}